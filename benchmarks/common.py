@@ -0,0 +1,43 @@
+"""
+Shared setup of the benchmarks: a throwaway SQLite database with the schema of models.py,
+seeded with n rows of every table. Run them from the repository root:
+    python benchmarks/references.py
+"""
+import os
+import sys
+import tempfile
+import datetime
+
+# the app reads these at import time, DATABASE_URL=postgresql://... benchmarks another database
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('CACHE_BACKEND', 'memory')
+# the bulk inserts of the seeding are slow queries by design
+os.environ.setdefault('SLOW_QUERY_MS', '10000')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+def seed(n=25):
+    # n users, planets, vehicles, characters and likes, the like i points at the rows i
+    from app import app
+    from models import db, User, Planet, Vehicle, Character, Like
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(1, n + 1):
+            db.session.add(User(user_name='u%d' % i, name='n', last_name='l', email='e%d@x' % i, phone=i))
+            db.session.add(Planet(name='p%d' % i, climate='arid' if i % 2 else 'temperate', terrain='t', population=i * 1000,
+                                  gravity='1', rotation_period=1, orbital_period=1, diameter=i, surface_water=1))
+            db.session.add(Vehicle(name='v%d' % i, model='m', manufacturer='mf', cost_in_credits=i, length=1,
+                                   max_atmosphering_speed=1, crew=1, passenger=1, cargo_capacity=1, consumables='c',
+                                   vehicle_class='wheeled'))
+        db.session.flush()
+        for i in range(1, n + 1):
+            db.session.add(Character(name='c%d' % i, height=1, mass=1, hair_color='h', skin_color='s', eye_color='e',
+                                     birth_year=datetime.datetime(2000, 1, 1), gender='male', planet_id=i))
+        db.session.flush()
+        for i in range(1, n + 1):
+            db.session.add(Like(planet_id=i, character_id=i, vehicle_id=i, user_id=i))
+        db.session.commit()
+    return app
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
@@ -0,0 +1,37 @@
+"""
+Response compression (user-025): CPU time against bytes saved for gzip, br and zstd at a
+low, the default and the maximum level on /characters pages, then whole requests with the
+compressed body cache warm. br and zstd need the brotli and zstandard packages.
+    python benchmarks/compression.py
+"""
+import gzip
+import timeit
+from common import seed
+
+app = seed(1000)
+
+from compression import GZIP_LEVEL, BROTLI_LEVEL, ZSTD_LEVEL, brotli, zstandard
+
+LEVELS = [('gzip-%d' % level, lambda body, level=level: gzip.compress(body, level, mtime=0)) for level in (1, GZIP_LEVEL, 9)]
+if brotli is not None:
+    LEVELS += [('br-%d' % level, lambda body, level=level: brotli.compress(body, quality=level)) for level in (1, BROTLI_LEVEL, 11)]
+if zstandard is not None:
+    LEVELS += [('zstd-%d' % level, lambda body, level=level: zstandard.compress(body, level)) for level in (1, ZSTD_LEVEL, 19)]
+
+def best_ms(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1000
+
+client = app.test_client()
+for limit in (100, 1000):
+    url = '/characters?limit=%d' % limit
+    body = client.get(url).get_data()
+    print('%s: %d bytes' % (url, len(body)))
+    for name, compress in LEVELS:
+        # the maximum levels take long enough that a few runs are plenty
+        elapsed = best_ms(lambda: compress(body), 20 if name in ('br-11', 'zstd-19') else 200)
+        size = len(compress(body))
+        print('  %-8s %8.3f ms  %7d bytes  saved %5.1f%%' % (name, elapsed, size, 100 - size * 100.0 / len(body)))
+    for encoding in ('identity', 'gzip', 'br', 'zstd'):
+        # the first request compresses, the others are served from compression.compressed_cache
+        elapsed = best_ms(lambda: client.get(url, headers={'Accept-Encoding': encoding}), 50)
+        print('  GET Accept-Encoding: %-8s %6.2f ms' % (encoding, elapsed))
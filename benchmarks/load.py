@@ -0,0 +1,90 @@
+"""
+Keep-alive load on the WSGI and the ASGI entry points (user-020): one gunicorn sync worker
+and one uvicorn process on the same seeded database, N connections each sending requests
+back to back for a few seconds.
+    python benchmarks/load.py [path] [connections,...] [seconds]
+    python benchmarks/load.py /planets/5 100 8
+gunicorn and uvicorn must be installed; 1000 connections need ulimit -n above 2000.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+from common import seed, percentile
+
+PATH = sys.argv[1] if len(sys.argv) > 1 else '/planets?limit=20'
+CONNECTIONS = [int(count) for count in (sys.argv[2] if len(sys.argv) > 2 else '10,100,1000').split(',')]
+SECONDS = float(sys.argv[3]) if len(sys.argv) > 3 else 8
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+SERVERS = (
+    ('gunicorn sync', ['gunicorn', 'wsgi', '-b', '127.0.0.1:8801', '-w', '1', '--log-level', 'warning'], 8801),
+    ('uvicorn asgi', ['uvicorn', 'asgi:application', '--port', '8802', '--log-level', 'warning', '--no-access-log'], 8802),
+)
+
+async def client(port, deadline, latencies, errors):
+    # one keep-alive connection, reopened when the server closes it
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            start = time.perf_counter()
+            writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n' % PATH).encode())
+            await writer.drain()
+            length, close = 0, False
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError('closed by the server')
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+                elif name.lower() == 'connection' and 'close' in value.lower():
+                    close = True
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            errors.append(1)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+
+async def load(port, connections):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + SECONDS
+    await asyncio.gather(*[client(port, deadline, latencies, errors) for _ in range(connections)])
+    return sorted(latencies), len(errors)
+
+def wait_for(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Nothing listens on port %d' % port)
+
+seed(100)
+print('GET %s, %g s per run' % (PATH, SECONDS))
+for name, command, port in SERVERS:
+    # the servers inherit DATABASE_URL, so they read the database seeded above
+    server = subprocess.Popen(command, cwd=SRC)
+    try:
+        wait_for(port)
+        for connections in CONNECTIONS:
+            latencies, errors = asyncio.run(load(port, connections))
+            print('%-14s %5d conns  %6.0f req/s  p50 %7.1f ms  p99 %7.1f ms  errors %d' % (
+                name, connections, len(latencies) / SECONDS, percentile(latencies, .5) * 1000,
+                percentile(latencies, .99) * 1000, errors))
+    finally:
+        server.terminate()
+        server.wait()
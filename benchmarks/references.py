@@ -0,0 +1,41 @@
+"""
+Foreign key checks of a like (user-005): the four SELECT ... LIMIT 1 the like routes ran
+before, against resources.missing_references and its single SELECT of EXISTS columns.
+    python benchmarks/references.py [validations]
+"""
+import sys
+import time
+from common import seed, percentile
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+ROWS = 50
+
+app = seed(ROWS)
+
+from sqlalchemy import event
+from models import db, Like, Character, Planet, User, Vehicle
+from resources import missing_references
+
+def one_query_per_table(row):
+    return [model.__tablename__ for model, key in ((Character, 'character_id'), (Planet, 'planet_id'),
+                                                    (User, 'user_id'), (Vehicle, 'vehicle_id'))
+            if model.query.filter_by(id=row[key]).first() is None]
+
+def single_exists_query(row):
+    return missing_references(db.session, Like, row)
+
+with app.app_context():
+    queries = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(1))
+    for check in (one_query_per_table, single_exists_query):
+        del queries[:]
+        latencies = []
+        for i in range(RUNS):
+            id = i % ROWS + 1
+            row = dict(character_id=id, planet_id=id, user_id=id, vehicle_id=id)
+            start = time.perf_counter()
+            check(row)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print('%-20s %.0f queries/like  p50 %.2f ms  p99 %.2f ms' % (
+            check.__name__, len(queries) / RUNS, percentile(latencies, .5) * 1000, percentile(latencies, .99) * 1000))
@@ -0,0 +1,66 @@
+"""
+Collection reads from plain rows (user-017): loading and serializing a whole planet table as
+ORM objects against utils.read_rows, then the page and NDJSON stream routes built on it.
+    python benchmarks/rows.py [planets]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from common import seed
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+app = seed(0)
+
+from models import db, Planet
+from utils import read_rows, default_fields, serialize
+
+def orm_objects():
+    return [item.serialize() for item in Planet.query.order_by(Planet.id).all()]
+
+def plain_rows():
+    query = Planet.query.with_entities(*[getattr(Planet, name) for name in fields]).order_by(Planet.id)
+    return [serialize(row, fields) for row in read_rows(query)]
+
+def measure(function):
+    # peak memory under tracemalloc, the time of a second run without it
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+    gc.collect()
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start, peak
+
+with app.app_context():
+    db.session.execute(Planet.__table__.insert(), [dict(
+        name='p%d' % i, climate='arid', terrain='t', population=i, gravity='1', rotation_period=1,
+        orbital_period=1, diameter=i, surface_water=1) for i in range(ROWS)])
+    db.session.commit()
+    fields = default_fields(Planet)
+    for function in (orm_objects, plain_rows):
+        elapsed, peak = measure(function)
+        print('load + serialize %-12s %7.0f rows/s  peak %6.1f MB' % (function.__name__, ROWS / elapsed, peak / 2 ** 20))
+
+client = app.test_client()
+best = float('inf')
+for _ in range(20):
+    start = time.perf_counter()
+    client.get('/planets?limit=1000')
+    best = min(best, time.perf_counter() - start)
+print('GET /planets?limit=1000  %.1f ms' % (best * 1000))
+
+tracemalloc.start()
+start = time.perf_counter()
+response = client.get('/planets?stream=1', buffered=False)
+count = sum(chunk.count(b'\n') for chunk in response.response)
+response.close()
+elapsed = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+print('GET /planets?stream=1    %d rows  %.0f rows/s (under tracemalloc)  peak %.1f MB' % (count, count / elapsed, peak / 2 ** 20))
@@ -0,0 +1,49 @@
+"""
+Request body validation (user-022): a complete create body through the checks that ran
+before validators.py (field copy, a scan of the writable columns per required field, then
+a conversion per value) against bulk.clean_item and its compiled validator.
+    python benchmarks/validation.py [runs]
+"""
+import sys
+import timeit
+from common import seed
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+seed(1)
+
+from models import Planet, Character
+from bulk import clean_item, writable_fields
+from utils import public_columns, coerce_value, READ_ONLY_FIELDS
+
+def previous_writable_fields(model):
+    return [name for name in public_columns(model) if name not in READ_ONLY_FIELDS]
+
+def previous_required_fields(model):
+    return [column.name for column in model.__table__.columns
+            if not column.nullable and not column.primary_key and column.name in previous_writable_fields(model)]
+
+def previous_clean_item(model, item, fields):
+    # clean_item then coerce_row as Resource.clean called them
+    row = dict((name, item[name]) for name in fields if name in item)
+    if not any(name in row for name in fields):
+        return None, 'At least one field shouldnt be empty'
+    missing = [name for name in previous_required_fields(model) if row.get(name) in (None, '')]
+    if missing:
+        return None, 'Missing fields: ' + ', '.join(missing)
+    return dict((name, value if value is None else coerce_value(model.__table__.c[name], value))
+                for name, value in row.items()), None
+
+BODIES = (
+    (Planet, dict(name='Tatooine', climate='arid', terrain='desert', population=200000, gravity='1',
+                  rotation_period=23, orbital_period=304, diameter=10465, surface_water=1)),
+    (Character, dict(name='Luke', height=172, mass=77, hair_color='blond', skin_color='fair', eye_color='blue',
+                     birth_year='1977-05-25T00:00:00', gender='male', planet_id=1)),
+)
+
+for model, body in BODIES:
+    before, after = previous_writable_fields(model), writable_fields(model)
+    assert previous_clean_item(model, body, before)[0] == clean_item(model, body, after)[0]
+    previous = min(timeit.repeat(lambda: previous_clean_item(model, body, before), number=RUNS, repeat=5)) / RUNS
+    current = min(timeit.repeat(lambda: clean_item(model, body, after), number=RUNS, repeat=5)) / RUNS
+    print('%-10s %6.1f us -> %4.1f us' % (model.__name__, previous * 1e6, current * 1e6))
@@ -0,0 +1,11 @@
+# gunicorn reads ./gunicorn.conf.py from the directory it starts in, the repository root for
+# the Procfile and render.yaml (gunicorn wsgi --chdir ./src/)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+def on_starting(server):
+    # once in the master before the first fork: /metrics totals start over with the server
+    from metrics import clear_snapshots
+    clear_snapshots()
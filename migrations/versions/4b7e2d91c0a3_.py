@@ -0,0 +1,35 @@
+"""add updated_at to every table
+
+Revision ID: 4b7e2d91c0a3
+Revises: caef3877c8f5
+Create Date: 2026-10-18 10:12:41.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d91c0a3'
+down_revision = 'caef3877c8f5'
+branch_labels = None
+depends_on = None
+
+TABLES = ('planet', 'user', 'vehicle', 'character', 'like')
+
+
+def upgrade():
+    for table in TABLES:
+        # existing rows get the migration time, then the column becomes NOT NULL
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(sa.table(table, sa.column('updated_at')).update().values(updated_at=sa.func.now()))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+            batch_op.create_index(batch_op.f('ix_%s_updated_at' % table), ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_%s_updated_at' % table))
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,38 @@
+"""composite indexes for filtering and sorting
+
+Revision ID: 5e0b9f3a7c64
+Revises: d81a6c4f2e95
+Create Date: 2026-10-18 12:31:55.871040
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0b9f3a7c64'
+down_revision = 'd81a6c4f2e95'
+branch_labels = None
+depends_on = None
+
+# equality filter first then range/sort column, or sort column then id for the keyset pagination
+INDEXES = (
+    ('planet', ('climate', 'population')),
+    ('planet', ('population', 'id')),
+    ('planet', ('diameter', 'id')),
+    ('vehicle', ('manufacturer', 'cost_in_credits')),
+    ('vehicle', ('vehicle_class', 'cost_in_credits')),
+    ('vehicle', ('cost_in_credits', 'id')),
+    ('character', ('gender', 'birth_year')),
+    ('character', ('birth_year', 'id')),
+)
+
+
+def upgrade():
+    for table, columns in INDEXES:
+        op.create_index('ix_%s_%s' % (table, '_'.join(columns)), table, list(columns), unique=False)
+
+
+def downgrade():
+    for table, columns in reversed(INDEXES):
+        op.drop_index('ix_%s_%s' % (table, '_'.join(columns)), table_name=table)
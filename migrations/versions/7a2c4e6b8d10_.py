@@ -0,0 +1,47 @@
+"""full text search indexes
+
+Revision ID: 7a2c4e6b8d10
+Revises: 5e0b9f3a7c64
+Create Date: 2026-10-18 13:07:14.662318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2c4e6b8d10'
+down_revision = '5e0b9f3a7c64'
+branch_labels = None
+depends_on = None
+
+# same columns and kind codes as src/search.py
+SEARCH_FIELDS = (
+    ('planet', 1, ('name', 'climate', 'terrain')),
+    ('character', 2, ('name', 'gender', 'hair_color', 'skin_color', 'eye_color')),
+    ('vehicle', 3, ('name', 'model', 'manufacturer', 'vehicle_class')),
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(name, body)')
+        for table, code, (name, *others) in SEARCH_FIELDS:
+            op.execute('INSERT INTO search_index (rowid, name, body) SELECT id * 4 + %d, %s, %s FROM "%s"'
+                       % (code, name, " || ' ' || ".join(others), table))
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, code, fields in SEARCH_FIELDS:
+        # the expression must match search_document() or the planner will not use the index
+        document = " || ' ' || ".join(fields)
+        op.execute('CREATE INDEX ix_%s_search ON "%s" USING gin (to_tsvector(\'simple\', %s))' % (table, table, document))
+        op.execute('CREATE INDEX ix_%s_name_trgm ON "%s" USING gin (name gin_trgm_ops)' % (table, table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS search_index')
+        return
+    for table, code, fields in reversed(SEARCH_FIELDS):
+        op.execute('DROP INDEX IF EXISTS ix_%s_name_trgm' % table)
+        op.execute('DROP INDEX IF EXISTS ix_%s_search' % table)
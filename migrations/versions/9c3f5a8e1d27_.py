@@ -0,0 +1,40 @@
+"""index the natural keys and the foreign keys
+
+Revision ID: 9c3f5a8e1d27
+Revises: 4b7e2d91c0a3
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3f5a8e1d27'
+down_revision = '4b7e2d91c0a3'
+branch_labels = None
+depends_on = None
+
+# (table, column, unique), unique indexes fail if the table already has duplicates
+INDEXES = (
+    ('user', 'user_name', True),
+    ('user', 'email', True),
+    ('planet', 'name', True),
+    ('vehicle', 'name', True),
+    ('character', 'name', True),
+    ('character', 'planet_id', False),
+    ('like', 'user_id', False),
+    ('like', 'planet_id', False),
+    ('like', 'character_id', False),
+    ('like', 'vehicle_id', False),
+)
+
+
+def upgrade():
+    for table, column, unique in INDEXES:
+        op.create_index(op.f('ix_%s_%s' % (table, column)), table, [column], unique=unique)
+
+
+def downgrade():
+    for table, column, unique in reversed(INDEXES):
+        op.drop_index(op.f('ix_%s_%s' % (table, column)), table_name=table)
@@ -0,0 +1,32 @@
+"""table versions for the collection ETags
+
+Revision ID: b3e8f1c5a7d2
+Revises: 7a2c4e6b8d10
+Create Date: 2026-10-18 16:42:08.310254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e8f1c5a7d2'
+down_revision = '7a2c4e6b8d10'
+branch_labels = None
+depends_on = None
+
+# the tables of models.RESOURCES
+TABLES = ('user', 'planet', 'vehicle', 'character', 'like')
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [{'name': name, 'version': 0} for name in TABLES])
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -0,0 +1,41 @@
+"""like_count counters on planet, character and vehicle
+
+Revision ID: d81a6c4f2e95
+Revises: 9c3f5a8e1d27
+Create Date: 2026-10-18 11:48:09.203377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81a6c4f2e95'
+down_revision = '9c3f5a8e1d27'
+branch_labels = None
+depends_on = None
+
+# counted table -> foreign key in like
+COUNTERS = (
+    ('planet', 'planet_id'),
+    ('character', 'character_id'),
+    ('vehicle', 'vehicle_id'),
+)
+
+
+def upgrade():
+    like = sa.table('like', sa.column('id'), sa.column('planet_id'), sa.column('character_id'), sa.column('vehicle_id'))
+    for table, foreign_key in COUNTERS:
+        op.add_column(table, sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+        op.create_index(op.f('ix_%s_like_count' % table), table, ['like_count'], unique=False)
+        # backfill from the existing likes, same as `flask repair-like-counts`
+        counted = sa.table(table, sa.column('id'), sa.column('like_count'))
+        count = sa.select(sa.func.count(like.c.id)).where(like.c[foreign_key] == counted.c.id).scalar_subquery()
+        op.execute(counted.update().values(like_count=count))
+
+
+def downgrade():
+    for table, foreign_key in reversed(COUNTERS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_%s_like_count' % table))
+            batch_op.drop_column('like_count')
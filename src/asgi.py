@@ -0,0 +1,311 @@
+"""
+ASGI entry point for the resource endpoints, run it with: uvicorn asgi:application --app-dir src
+List, detail, create, update and delete for every resource declared in resources.py, on
+SQLAlchemy's async engine (aiosqlite or asyncpg), so one process holds thousands of keep-alive
+clients while their queries wait on the database. The same Resource objects give the fields,
+validation, immutable fields and messages of the flask app, with the same filters, cursors,
+ETags and cache; admin, top, bulk, search and /metrics stay on wsgi.py.
+"""
+import os
+import re
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_etags, quote_etag, parse_accept_header
+from werkzeug.urls import url_decode
+from resources import API_RESOURCES
+from utils import (APIException, NDJSON_MIMETYPE, STREAM_BATCH_SIZE, keyset, page, get_page_size, get_fields,
+                   get_ids, order_by_ids, versions_query, make_collection_etag, wants_stream,
+                   entity_etag, unique_violation)
+from filters import apply_filters, get_sort
+from expand import get_expand, expand_fields, expanded_models, expand
+from cache import entity_cache, pick
+from database import engine_options
+from jsonprovider import dumps, loads
+from compression import negotiate, compressible, compress
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+ROUTE = re.compile(r'^/(%s)(?:/(\d+))?/?$' % '|'.join(API_RESOURCES))
+# methods of /<resource> and /<resource>/<id>, answered to the CORS preflight
+COLLECTION_METHODS = b'GET, HEAD, POST, OPTIONS'
+ITEM_METHODS = b'GET, HEAD, PUT, DELETE, OPTIONS'
+
+def async_engine_options(url):
+    # the pool settings of database.py, with the async pool and asyncpg's way of passing settings
+    options = engine_options(url)
+    options.pop('poolclass', None)
+    connect_args = options.pop('connect_args', None)
+    if connect_args:
+        timeout = connect_args['options'].rsplit('=', 1)[1]
+        options['connect_args'] = {'server_settings': {'statement_timeout': timeout}}
+    return options
+
+def create_engine_from_env():
+    url = make_url(os.getenv("DATABASE_URL", "sqlite:////tmp/test.db").replace("postgres://", "postgresql://"))
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('No async driver for %s, use wsgi.py' % backend)
+    return create_async_engine(url.set(drivername=ASYNC_DRIVERS[backend]), **async_engine_options(str(url)))
+
+engine = create_engine_from_env()
+
+class Request:
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = url_decode(self.query_string)
+        self.headers = dict((name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers'])
+        self.body = body
+        self.streaming = False
+
+    def json(self):
+        # None when the body is not JSON, as flask's get_json(silent=True)
+        try:
+            return loads(self.body)
+        except ValueError:
+            return None
+
+    def not_modified(self, etag):
+        return parse_etags(self.headers.get('if-none-match')).contains_weak(etag)
+
+    def wants_stream(self):
+        return wants_stream(self.args, parse_accept_header(self.headers.get('accept'), MIMEAccept))
+
+def json_response(status, body, etag=None, vary=None):
+    headers = [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]
+    if vary is not None:
+        headers.append((b'vary', vary))
+    if status == 304:
+        if etag is not None:
+            headers.append((b'etag', quote_etag(etag).encode()))
+        return status, headers, None, etag
+    return status, headers, dumps(body), etag
+
+def preflight(request, methods):
+    # what CORS(app) answers on the flask app: any origin, the headers the browser asks for
+    headers = [(b'allow', methods), (b'access-control-allow-origin', b'*'), (b'access-control-allow-methods', methods)]
+    requested = request.headers.get('access-control-request-headers')
+    if requested:
+        headers.append((b'access-control-allow-headers', requested.encode('latin-1')))
+    return 200, headers, b'', None
+
+def finish_response(request, response):
+    # negotiated compression as in compression.py, then the ETag and a known length, which
+    # keeps the response out of chunked encoding
+    status, headers, body, etag = response
+    if body is None:
+        return status, headers, body
+    weak = False
+    if status == 200 and compressible('application/json', len(body)):
+        headers.append((b'vary', b'Accept-Encoding'))
+        encoding = negotiate(parse_accept_header(request.headers.get('accept-encoding')))
+        if encoding is not None:
+            body = compress(body, encoding, etag)
+            headers.append((b'content-encoding', encoding.encode()))
+            weak = True
+    if etag is not None:
+        headers.append((b'etag', quote_etag(etag, weak).encode()))
+    headers.append((b'content-length', b'%d' % len(body)))
+    return status, headers, body
+
+def error_response(status, message):
+    # the errors the flask handlers answer themselves have an 'error' body, APIException.to_dict
+    # is for what flask's errorhandler answers
+    return json_response(status, {'error': message})
+
+async def commit(session, resource):
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if unique_violation(e):
+            raise APIException('%s already exists' % resource.label, status_code=409)
+        raise
+
+async def list_items(request, resource, send):
+    model = resource.model
+    sort = get_sort(model, request.args)
+    tree = get_expand(model, request.args)
+    fields = expand_fields(get_fields(model, sort, request.args) or resource.fields, model, tree)
+    limit = get_page_size(args=request.args)
+    statement = apply_filters(select(*[getattr(model, name) for name in fields]), model, request.args)
+    async with engine.connect() as connection:
+        # same ETag as the flask app for the same tables, representation and query string
+        ids = get_ids(request.args)
+        stream = ids is None and request.wants_stream()
+        models = [model] + expanded_models(model, tree)
+        versions = (await connection.execute(versions_query(models))).all()
+        etag = make_collection_etag(models, versions, stream, request.query_string)
+        if request.not_modified(etag):
+            return json_response(304, None, etag, b'Accept')
+
+        async def embed(items):
+            # the IN queries of expand.py run on the sync side of this connection
+            if tree:
+                await connection.run_sync(expand, model, items, tree)
+            return items
+
+        if ids is not None:
+            rows, missing = order_by_ids((await connection.execute(statement.where(model.id.in_(ids)))).all(), ids)
+            return json_response(200, {
+                "msg": "ok",
+                "results": await embed([dict(zip(fields, item)) for item in rows]),
+                "missing": missing
+            }, etag, b'Accept')
+        if stream:
+            await stream_rows(request, connection, keyset(statement, model, sort, request.args), fields, etag, send, embed)
+            return None
+        rows = (await connection.execute(keyset(statement, model, sort, request.args).limit(limit + 1))).all()
+        items, next_cursor = page(rows, limit, sort)
+        return json_response(200, {
+            "msg": "ok",
+            "results": await embed([dict(zip(fields, item)) for item in items]),
+            "next_cursor": next_cursor
+        }, etag, b'Accept')
+
+async def stream_rows(request, connection, statement, fields, etag, send, embed):
+    # NDJSON straight from a server side cursor, the connection stays open until the last row
+    result = await connection.stream(statement)
+    request.streaming = True
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', NDJSON_MIMETYPE.encode()), (b'etag', quote_etag(etag).encode()), (b'vary', b'Accept'),
+        (b'access-control-allow-origin', b'*')]})
+    async for batch in result.partitions(STREAM_BATCH_SIZE):
+        items = await embed([dict(zip(fields, item)) for item in batch])
+        body = b''.join(dumps(item) + b'\n' for item in items)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def cache_call(method, *args):
+    # the file and redis backends wait on the disk or the network, they run in the default
+    # thread pool so the other requests of the loop go on meanwhile
+    if entity_cache.backend.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def get_item(request, resource, item_id):
+    model = resource.model
+    fields = get_fields(model, args=request.args)
+    cached = await cache_call(entity_cache.get, model, item_id)
+    if cached is None:
+        names = resource.fields
+        async with engine.connect() as connection:
+            row = (await connection.execute(
+                select(model.updated_at, *[getattr(model, name) for name in names]).where(model.id == item_id))).first()
+        if row is None:
+            return error_response(404, resource.not_found)
+        cached = {'version': row[0].isoformat(), 'result': dict(zip(names, row[1:]))}
+        await cache_call(entity_cache.add, model, item_id, cached)
+    etag = entity_etag(model, item_id, cached['version'], fields)
+    if request.not_modified(etag):
+        return json_response(304, None, etag)
+    return json_response(200, {"msg": "ok", "result": pick(cached, fields)}, etag)
+
+async def write(session, resource, item, row, status, verb):
+    # Resource.write on an AsyncSession: the mapper and session events (like counters, search
+    # index, cache, table versions) run as in the flask app
+    error = await session.run_sync(resource.missing_error, row)
+    if error:
+        return error_response(404, error)
+    for name, value in row.items():
+        setattr(item, name, value)
+    session.add(item)
+    await commit(session, resource)
+    return json_response(status, resource.saved(item, verb))
+
+async def create_item(request, resource):
+    try:
+        row = resource.clean(request.json(), resource.create_fields)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            return await write(session, resource, resource.model(), row, 201, 'created')
+    except APIException as e:
+        return error_response(e.status_code, e.message)
+
+async def update_item(request, resource, item_id):
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            item = await session.get(resource.model, item_id)
+            if item is None:
+                return error_response(404, resource.not_found + '.')
+            row = resource.update_row(item, request.json())
+            return await write(session, resource, item, row, 200, 'updated')
+    except APIException as e:
+        return error_response(e.status_code, e.message)
+
+async def delete_item(request, resource, item_id):
+    async with AsyncSession(engine) as session:
+        item = await session.get(resource.model, item_id)
+        if item is None:
+            return error_response(404, resource.not_found)
+        await session.delete(item)
+        await commit(session, resource)
+    return json_response(200, {'message': '%s deleted successfully.' % resource.label})
+
+async def dispatch(request, path, send):
+    match = ROUTE.match(path)
+    if match is None:
+        raise APIException('Not found', status_code=404)
+    resource = API_RESOURCES[match.group(1)]
+    item_id = int(match.group(2)) if match.group(2) else None
+    if request.method == 'OPTIONS':
+        return preflight(request, COLLECTION_METHODS if item_id is None else ITEM_METHODS)
+    if item_id is None:
+        if request.method in ('GET', 'HEAD'):
+            return await list_items(request, resource, send)
+        if request.method == 'POST':
+            return await create_item(request, resource)
+    else:
+        if request.method in ('GET', 'HEAD'):
+            return await get_item(request, resource, item_id)
+        if request.method == 'PUT':
+            return await update_item(request, resource, item_id)
+        if request.method == 'DELETE':
+            return await delete_item(request, resource, item_id)
+    raise APIException('Method not allowed', status_code=405)
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    request = Request(scope, await read_body(receive))
+    try:
+        response = await dispatch(request, scope['path'], send)
+        if response is None:
+            # streamed, already sent
+            return
+    except APIException as e:
+        response = json_response(e.status_code, e.to_dict())
+    except Exception as e:
+        if request.streaming:
+            # the status line is gone already, let the server drop the connection
+            raise
+        response = json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
+    status, headers, body = finish_response(request, response)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if body is None or request.method == 'HEAD' else body})
@@ -0,0 +1,211 @@
+"""
+Bulk create/update/delete for every resource, used by the /<resource>/bulk endpoints
+"""
+from sqlalchemy.orm import ONETOMANY
+from models import db, User, Planet, Vehicle, Character, Like, LIKE_COUNTERS, apply_like_deltas, like_deltas
+from utils import public_columns, READ_ONLY_FIELDS
+from cache import invalidate_on_commit, mark_written
+from search import SEARCH_FIELDS, reindex, unindex_ids
+from validators import validator
+
+# rows validated, checked and written per round trip
+BULK_BATCH_SIZE = 1000
+
+# natural keys that create_* and update_* check before writing
+UNIQUE_FIELDS = {
+    User: ('user_name', 'email'),
+    Planet: ('name',),
+    Vehicle: ('name',),
+    Character: ('name',),
+}
+
+def chunks(items, size=BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+def writable_fields(model):
+    return tuple(name for name in public_columns(model) if name not in READ_ONLY_FIELDS)
+
+def existing_values(model, field, values, *columns):
+    # one SELECT ... WHERE field IN (...) per batch instead of one query per row
+    values = set(value for value in values if value is not None)
+    if not values:
+        return []
+    column = getattr(model, field)
+    return db.session.query(*(columns or (column,))).filter(column.in_(values)).all()
+
+def check_foreign_keys(model, batch, errors):
+    for column in model.__table__.columns:
+        for foreign_key in column.foreign_keys:
+            target = foreign_key.column
+            values = set(row[column.name] for _, row in batch if row.get(column.name) is not None)
+            if not values:
+                continue
+            found = set(value for value, in db.session.query(target).filter(target.in_(values)).all())
+            for index, row in batch:
+                value = row.get(column.name)
+                if value is not None and value not in found and index not in errors:
+                    errors[index] = '%s %s not found' % (target.table.name.capitalize(), value)
+
+def check_unique(model, batch, errors, updating=False):
+    for field in UNIQUE_FIELDS.get(model, ()):
+        seen = {}
+        for index, row in batch:
+            value = row.get(field)
+            if value is None or index in errors:
+                continue
+            if value in seen:
+                errors[index] = '%s %s is repeated in the request' % (field, value)
+            seen[value] = row.get('id')
+        taken = existing_values(model, field, seen.keys(), getattr(model, field), model.id)
+        owners = dict(taken)
+        for index, row in batch:
+            value = row.get(field)
+            if index in errors or value not in owners:
+                continue
+            if not updating or owners[value] != row['id']:
+                errors[index] = '%s %s already exists' % (field, value)
+
+def clean_item(model, item, fields, updating=False):
+    # fields is a tuple, its validator is compiled on the first call and reused after
+    if updating and isinstance(item, dict) and type(item.get('id')) is not int:
+        return None, 'id is required'
+    row, error = validator(model, fields)(item, partial=updating)
+    if error:
+        return None, error
+    if updating:
+        row['id'] = item['id']
+    return row, None
+
+def current_like_references(ids, names):
+    columns = [getattr(Like, name) for name in names]
+    return dict((row[0], dict(zip(names, row[1:]))) for row in db.session.query(Like.id, *columns).filter(Like.id.in_(ids)))
+
+def like_update_deltas(rows):
+    # only the references present in each row change, the counters follow old -> new
+    names = list(LIKE_COUNTERS)
+    old = current_like_references([row['id'] for row in rows], names)
+    before, after = [], []
+    for row in rows:
+        changed = [name for name in names if name in row]
+        before.append(dict((name, old[row['id']][name]) for name in changed))
+        after.append(dict((name, row[name]) for name in changed))
+    deltas = like_deltas(before, -1)
+    for key, delta in like_deltas(after, 1).items():
+        deltas[key] = deltas.get(key, 0) + delta
+    return deltas
+
+def report(count_key, count, errors):
+    return {
+        "msg": "ok",
+        count_key: count,
+        "errors": [{"index": index, "error": error} for index, error in sorted(errors.items())]
+    }
+
+def bulk_create(model, items):
+    fields = writable_fields(model)
+    errors = {}
+    created = 0
+    for start, chunk in chunks(items):
+        batch = []
+        for offset, item in enumerate(chunk):
+            row, error = clean_item(model, item, fields)
+            if error:
+                errors[start + offset] = error
+            else:
+                batch.append((start + offset, row))
+        check_unique(model, batch, errors)
+        check_foreign_keys(model, batch, errors)
+        rows = [row for index, row in batch if index not in errors]
+        if rows:
+            # executemany INSERT, no ORM objects and no per-row flush
+            db.session.execute(model.__table__.insert(), rows)
+            mark_written(db.session, model.__tablename__)
+            if model is Like:
+                apply_like_deltas(db.session, db.session, like_deltas(rows, 1))
+            if model in SEARCH_FIELDS:
+                reindex(db.session.connection(), model, model.name, [row['name'] for row in rows])
+            created += len(rows)
+    db.session.commit()
+    return report('created', created, errors)
+
+def bulk_update(model, items, fields=None, immutable=()):
+    # fields defaults to writable_fields. immutable fields are validated with them but may only
+    # repeat their current value, as Resource.update checks it, then they are left out of the row
+    fields = tuple(fields or writable_fields(model)) + tuple(immutable)
+    errors = {}
+    updated = 0
+    for start, chunk in chunks(items):
+        batch = []
+        for offset, item in enumerate(chunk):
+            row, error = clean_item(model, item, fields, updating=True)
+            if error:
+                errors[start + offset] = error
+            else:
+                batch.append((start + offset, row))
+        columns = [model.id] + [getattr(model, name) for name in immutable]
+        current = dict((values[0], values[1:]) for values in existing_values(model, 'id', [row['id'] for _, row in batch], *columns))
+        for index, row in batch:
+            if row['id'] not in current:
+                errors[index] = '%s %s not found' % (model.__name__, row['id'])
+                continue
+            changed = [name for name, value in zip(immutable, current[row['id']]) if name in row and row[name] != value]
+            if changed:
+                errors[index] = '%s cannot be changed' % ', '.join(changed)
+                continue
+            for name in immutable:
+                row.pop(name, None)
+            if len(row) == 1:
+                errors[index] = 'At least one field shouldnt be empty'
+        check_unique(model, batch, errors, updating=True)
+        check_foreign_keys(model, batch, errors)
+        rows = [row for index, row in batch if index not in errors]
+        if rows:
+            if model is Like:
+                apply_like_deltas(db.session, db.session, like_update_deltas(rows))
+            db.session.bulk_update_mappings(model, rows)
+            if model in SEARCH_FIELDS:
+                reindex(db.session.connection(), model, model.id, [row['id'] for row in rows])
+            for row in rows:
+                invalidate_on_commit(db.session, model.__tablename__, row['id'])
+            updated += len(rows)
+    db.session.commit()
+    return report('updated', updated, errors)
+
+def bulk_delete(model, items):
+    errors = {}
+    deleted = 0
+    for start, chunk in chunks(items):
+        batch = []
+        for offset, item in enumerate(chunk):
+            # accept both [1, 2] and [{"id": 1}, {"id": 2}]
+            item_id = item.get('id') if isinstance(item, dict) else item
+            # bool is an int subclass, true must not delete the row 1
+            if type(item_id) is not int:
+                errors[start + offset] = 'id is required'
+            else:
+                batch.append((start + offset, item_id))
+        found = set(value for value, in existing_values(model, 'id', [item_id for _, item_id in batch]))
+        for index, item_id in batch:
+            if item_id not in found:
+                errors[index] = '%s %s not found' % (model.__name__, item_id)
+        ids = [item_id for index, item_id in batch if index not in errors]
+        if not ids:
+            continue
+        if model is Like:
+            apply_like_deltas(db.session, db.session, like_deltas(current_like_references(ids, list(LIKE_COUNTERS)).values(), -1))
+        # same as db.session.delete(): children referencing the rows get their foreign key nulled
+        for relationship in model.__mapper__.relationships:
+            if relationship.direction is ONETOMANY:
+                child = relationship.mapper.class_
+                for local, remote in relationship.local_remote_pairs:
+                    db.session.query(child).filter(remote.in_(ids)).update({remote.name: None}, synchronize_session=False)
+                invalidate_on_commit(db.session, child.__tablename__)
+        db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        if model in SEARCH_FIELDS:
+            unindex_ids(db.session.connection(), model, ids)
+        for item_id in ids:
+            invalidate_on_commit(db.session, model.__tablename__, item_id)
+        deleted += len(ids)
+    db.session.commit()
+    return report('deleted', deleted, errors)
@@ -0,0 +1,454 @@
+import os
+import time
+import hashlib
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from sqlalchemy import event
+from sqlalchemy.orm import Session, ONETOMANY
+from jsonprovider import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# file: one file per entry shared by every worker on the host, redis: any server speaking the
+# redis protocol, shared by every host, memory: per worker LRU.
+# memory is only consistent with a single worker: a write invalidates the cache of the worker
+# that served it, the other gunicorn workers keep serving the old entry for ENTITY_CACHE_TTL.
+# Use it for a single process (flask run, tests), file is the default for that reason
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+# one directory per database, two apps on the same host never read each other's entries
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'flask-cache-' + hashlib.sha1(os.environ.get('DATABASE_URL', '').encode()).hexdigest()[:12]))
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 10000))
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 60))
+# seconds between two passes removing the expired and the surplus entries of the file backend
+CACHE_CLEANUP_INTERVAL = float(os.environ.get('CACHE_CLEANUP_INTERVAL', 30))
+# an invalidated entry (or table) is kept as a tombstone this long, the entry a request loaded
+# before the write cannot be stored back: longer than any read between a miss and its fill
+CACHE_TOMBSTONE_TTL = float(os.environ.get('CACHE_TOMBSTONE_TTL', 10))
+
+class MemoryBackend:
+    # an invalidated key holds a tombstone, (expires, None), until CACHE_TOMBSTONE_TTL
+    # calls never wait on I/O, asgi.py runs them on the event loop
+    blocking = False
+
+    def __init__(self, max_size=ENTITY_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # table -> time until which its entries cannot be added
+        self.deleted_tables = {}
+        self.evictions = 0
+
+    def get(self, table, entity_id):
+        key = (table, entity_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def store(self, key, payload, ttl):
+        # with the lock held
+        self.entries[key] = (time.time() + ttl, payload)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, table, entity_id, payload, ttl):
+        with self.lock:
+            self.store((table, entity_id), payload, ttl)
+
+    def add(self, table, entity_id, payload, ttl):
+        # only when nothing, not even a tombstone, is stored for the key
+        key = (table, entity_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if self.deleted_tables.get(table, 0) > now or (entry is not None and entry[0] >= now):
+                return False
+            self.store(key, payload, ttl)
+            return True
+
+    def delete(self, table, entity_id=None):
+        with self.lock:
+            if entity_id is not None:
+                self.store((table, entity_id), None, CACHE_TOMBSTONE_TTL)
+                return
+            self.deleted_tables[table] = time.time() + CACHE_TOMBSTONE_TTL
+            for key in [key for key in self.entries if key[0] == table]:
+                del self.entries[key]
+
+    def stats(self):
+        return {
+            'entity_cache_evictions_total': self.evictions,
+            'entity_cache_entries': len(self.entries),
+        }
+
+class FileBackend:
+    # /dev/shm is memory backed, so this is shared memory for every worker on the host.
+    # The mtime of an entry is its expiry time: every CACHE_CLEANUP_INTERVAL seconds a pass
+    # removes the expired entries, then the ones over max_size, soonest to expire first
+    blocking = True
+
+    def __init__(self, directory=CACHE_DIR, max_size=ENTITY_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.last_cleanup = time.monotonic()
+        self.evictions = 0
+
+    def path(self, table, entity_id):
+        return os.path.join(self.directory, table, '%s.json' % entity_id)
+
+    def tombstone(self, table):
+        # the mtime of <table>.tombstone is the time until which the table cannot be filled again
+        return os.path.join(self.directory, '%s.tombstone' % table)
+
+    def live(self, path):
+        try:
+            return os.stat(path).st_mtime >= time.time()
+        except FileNotFoundError:
+            return False
+
+    def get(self, table, entity_id):
+        try:
+            with open(self.path(table, entity_id), 'rb') as f:
+                entry = loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] < time.time():
+            return None
+        return entry['payload']
+
+    def write(self, path, payload, ttl):
+        # the complete entry in a temporary file, other workers never read half an entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        expires = time.time() + ttl
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(dumps({'expires': expires, 'payload': payload}))
+        os.utime(tmp, (expires, expires))
+        return tmp
+
+    def set(self, table, entity_id, payload, ttl):
+        path = self.path(table, entity_id)
+        os.replace(self.write(path, payload, ttl), path)
+        self.maybe_cleanup()
+
+    def add(self, table, entity_id, payload, ttl):
+        # link() fails when the path exists, so a tombstone left by a delete is never overwritten
+        path = self.path(table, entity_id)
+        tmp = self.write(path, payload, ttl)
+        try:
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                if self.live(path):
+                    return False
+                # expired, removed and linked again: a tombstone written in between still wins
+                self.remove(path)
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    return False
+        finally:
+            self.remove(tmp)
+        # checked after the link, a table deleted since then has either removed the entry or
+        # left its tombstone here
+        if self.live(self.tombstone(table)):
+            self.remove(path)
+            return False
+        self.maybe_cleanup()
+        return True
+
+    def delete(self, table, entity_id=None):
+        if entity_id is not None:
+            self.set(table, entity_id, None, CACHE_TOMBSTONE_TTL)
+            return
+        tombstone = self.tombstone(table)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(tombstone, 'wb'):
+            pass
+        expires = time.time() + CACHE_TOMBSTONE_TTL
+        os.utime(tombstone, (expires, expires))
+        # move the table away first so nobody reads from it while it is being removed
+        target = os.path.join(self.directory, table)
+        trash = '%s.%d.%d.deleted' % (target, os.getpid(), threading.get_ident())
+        try:
+            os.rename(target, trash)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def maybe_cleanup(self):
+        # each worker runs it at most once per interval, a pass that races another one only
+        # finds some files already gone
+        if time.monotonic() - self.last_cleanup < CACHE_CLEANUP_INTERVAL:
+            return
+        self.last_cleanup = time.monotonic()
+        try:
+            self.cleanup()
+        except OSError as e:
+            logger.warning('Cache cleanup failed: %s', e)
+
+    def cleanup(self):
+        now = time.time()
+        entries = []
+        for table in os.scandir(self.directory):
+            if not table.is_dir():
+                continue
+            if table.name.endswith('.deleted'):
+                # left behind by a worker that died while removing a table
+                shutil.rmtree(table.path, ignore_errors=True)
+                continue
+            for entry in os.scandir(table.path):
+                try:
+                    expires = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # a writer may still be on it, only the ones left by a dead worker go
+                    if expires < now - CACHE_CLEANUP_INTERVAL:
+                        self.remove(entry.path)
+                elif expires < now:
+                    self.remove(entry.path)
+                else:
+                    entries.append((expires, entry.path))
+        if len(entries) > self.max_size:
+            entries.sort()
+            for expires, path in entries[:len(entries) - self.max_size]:
+                self.remove(path)
+                self.evictions += 1
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {'entity_cache_evictions_total': self.evictions}
+
+ADD_SCRIPT = '''
+if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+if redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then return 1 end
+return 0
+'''
+
+class RedisBackend:
+    # one key per entry with its own expiry (SET ... PX), the server removes the expired ones;
+    # set maxmemory with maxmemory-policy volatile-lru to bound its size.
+    # speaks the protocol directly, the app does not depend on a redis client library
+    blocking = True
+
+    def __init__(self, url=CACHE_URL, timeout=0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.pid = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.reader = self.sock.makefile('rb')
+        # a forked worker must not share the parent's socket
+        self.pid = os.getpid()
+        if self.password:
+            self.send('AUTH', self.password)
+        if self.db:
+            self.send('SELECT', self.db)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    def send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RuntimeError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if kind == b'*':
+            return [self.read_reply() for _ in range(int(rest))]
+        raise ConnectionError('Unexpected reply from the cache server')
+
+    def command(self, *args):
+        with self.lock:
+            try:
+                if self.sock is None or self.pid != os.getpid():
+                    self.connect()
+                return self.send(*args)
+            except (OSError, ConnectionError):
+                self.close()
+                raise
+
+    def key(self, table, entity_id):
+        return 'cache:%s:%s' % (table, entity_id)
+
+    def get(self, table, entity_id):
+        raw = self.command('GET', self.key(table, entity_id))
+        if raw is None:
+            return None
+        return loads(raw)
+
+    def set(self, table, entity_id, payload, ttl):
+        self.command('SET', self.key(table, entity_id), dumps(payload), 'PX', int(ttl * 1000))
+
+    def add(self, table, entity_id, payload, ttl):
+        # atomic on the server: no table tombstone and nothing stored for the key (SET NX)
+        return self.command('EVAL', ADD_SCRIPT, 2, self.key(table, entity_id), 'cache-deleted:' + table,
+                            dumps(payload), int(ttl * 1000)) == 1
+
+    def delete(self, table, entity_id=None):
+        # the tombstones are plain keys that expire after CACHE_TOMBSTONE_TTL
+        if entity_id is not None:
+            self.set(table, entity_id, None, CACHE_TOMBSTONE_TTL)
+            return
+        self.command('SET', 'cache-deleted:' + table, 1, 'PX', int(CACHE_TOMBSTONE_TTL * 1000))
+        # a whole table is rare (a parent deleted under its children), SCAN keeps the server responsive
+        cursor = b'0'
+        while True:
+            cursor, keys = self.command('SCAN', cursor, 'MATCH', self.key(table, '*'), 'COUNT', 1000)
+            if keys:
+                self.command('DEL', *keys)
+            if cursor == b'0':
+                return
+
+    def stats(self):
+        return {}
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'file': FileBackend,
+    'redis': RedisBackend,
+}
+
+class EntityCache:
+    # a cache failure must never fail the request, it only turns into a miss
+
+    def __init__(self, backend, ttl=ENTITY_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, model, entity_id):
+        try:
+            payload = self.backend.get(model.__tablename__, entity_id)
+        except Exception as e:
+            logger.warning('Cache read failed: %s', e)
+            self.errors += 1
+            payload = None
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    def add(self, model, entity_id, payload):
+        # fills the entry after a miss, unless a write invalidated it since: the payload was read
+        # before that write committed and would be served stale for the whole TTL
+        try:
+            self.backend.add(model.__tablename__, entity_id, payload, self.ttl)
+        except Exception as e:
+            logger.warning('Cache write failed: %s', e)
+            self.errors += 1
+
+    def delete(self, table, entity_id=None):
+        # entity_id None drops every entry of the table
+        try:
+            self.backend.delete(table, entity_id)
+        except Exception as e:
+            logger.error('Cache invalidation failed for %s %s: %s', table, entity_id, e)
+            self.errors += 1
+
+    def stats(self):
+        stats = {
+            'entity_cache_hits_total': self.hits,
+            'entity_cache_misses_total': self.misses,
+            'entity_cache_errors_total': self.errors,
+        }
+        stats.update(self.backend.stats())
+        return stats
+
+entity_cache = EntityCache(BACKENDS[CACHE_BACKEND]())
+
+def pick(cached, fields):
+    # cached is {'version': updated_at, 'result': default fields}, ?fields= may also ask for
+    # updated_at, which is left out of the result but is the version
+    payload = cached['result']
+    if fields is None:
+        return payload
+    return dict((name, cached['version'] if name == 'updated_at' else payload[name]) for name in fields)
+
+def mark_written(session, table):
+    # the table's row in table_version is bumped right before the commit, see models.py
+    session.info.setdefault('written', set()).add(table)
+
+def invalidate_on_commit(session, table, entity_id=None):
+    # writes that skip the unit of work (bulk and Core statements) register themselves here
+    session.info.setdefault('invalidate', set()).add((table, entity_id))
+    mark_written(session, table)
+
+# every object the unit of work updates or deletes is dropped from the cache once the
+# transaction commits, so the handlers never have to remember to do it
+@event.listens_for(Session, 'after_flush')
+def collect_invalidations(session, flush_context):
+    for instance in session.new:
+        table = getattr(instance, '__tablename__', None)
+        if table is not None:
+            mark_written(session, table)
+    for instance in list(session.dirty) + list(session.deleted):
+        table = getattr(instance, '__tablename__', None)
+        if table is not None:
+            invalidate_on_commit(session, table, instance.id)
+    # deleting a parent nulls the foreign key of its children inside the flush
+    for instance in session.deleted:
+        for relationship in instance.__mapper__.relationships:
+            if relationship.direction is ONETOMANY:
+                invalidate_on_commit(session, relationship.mapper.local_table.name)
+
+@event.listens_for(Session, 'after_commit')
+def apply_invalidations(session):
+    for table, entity_id in session.info.pop('invalidate', ()):
+        entity_cache.delete(table, entity_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_invalidations(session, previous_transaction):
+    session.info.pop('invalidate', None)
+    session.info.pop('written', None)
@@ -0,0 +1,77 @@
+"""
+Response compression negotiated from Accept-Encoding: zstd and br when the zstandard and
+brotli packages are installed, gzip always. Bodies under COMPRESSION_MIN_SIZE bytes go out
+as they are, streamed responses (NDJSON) are never compressed.
+"""
+import os
+import gzip
+from flask import request
+from cache import MemoryBackend, ENTITY_CACHE_TTL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# higher is smaller and slower
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_LEVEL = int(os.environ.get('BROTLI_LEVEL', 4))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+# compressed bodies kept per worker, by ETag and encoding
+COMPRESSED_CACHE_SIZE = int(os.environ.get('COMPRESSED_CACHE_SIZE', 1000))
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS['zstd'] = lambda body: zstandard.compress(body, ZSTD_LEVEL)
+if brotli is not None:
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=BROTLI_LEVEL)
+# mtime=0 keeps the output the same for the same body
+ENCODERS['gzip'] = lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)
+# server preference when the client accepts several with the same quality
+ENCODINGS = list(ENCODERS)
+
+# an ETag names exactly one body, so its compressed bytes stay valid as long as the ETag does:
+# the cached entities and the hot collection pages are compressed once, not on every request
+compressed_cache = MemoryBackend(COMPRESSED_CACHE_SIZE)
+
+def negotiate(accept):
+    # werkzeug Accept of the Accept-Encoding header -> encoding, None for identity
+    return accept.best_match(ENCODINGS)
+
+def compressible(mimetype, size):
+    return size >= COMPRESSION_MIN_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def compress(body, encoding, etag=None):
+    if etag is None:
+        return ENCODERS[encoding](body)
+    data = compressed_cache.get(encoding, etag)
+    if data is None:
+        data = ENCODERS[encoding](body)
+        compressed_cache.set(encoding, etag, data, ENTITY_CACHE_TTL)
+    return data
+
+def setup_compression(app):
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not compressible(response.mimetype or '', response.calculate_content_length() or 0)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        etag, weak = response.get_etag()
+        response.set_data(compress(response.get_data(), encoding, None if weak else etag))
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            # the compressed bytes are a different representation, If-None-Match compares weakly
+            response.set_etag(etag, weak=True)
+        return response
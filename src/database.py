@@ -0,0 +1,94 @@
+"""
+Engine and connection pool settings, read from the environment.
+Every gunicorn worker gets its own pool, so the server sees up to
+workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections: keep that under max_connections.
+"""
+import os
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# connections older than this are replaced, below the server and load balancer idle timeouts
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# test every connection on checkout, a failover then costs a reconnect instead of a 500
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+# milliseconds, 0 disables it
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+# per process, sampled into /metrics after every request
+pool_stats = {
+    'db_pool_checkouts_total': 0,
+    'db_pool_wait_seconds_total': 0.0,
+    'db_pool_timeouts_total': 0,
+}
+pool_stats_lock = threading.Lock()
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that measures how long each checkout waits for a connection
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            with pool_stats_lock:
+                pool_stats['db_pool_timeouts_total'] += 1
+            raise
+        finally:
+            with pool_stats_lock:
+                pool_stats['db_pool_checkouts_total'] += 1
+                pool_stats['db_pool_wait_seconds_total'] += time.perf_counter() - start
+
+def set_mysql_timeout(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET SESSION max_execution_time = %d' % DB_STATEMENT_TIMEOUT_MS)
+    cursor.close()
+
+def engine_options(url):
+    # SQLALCHEMY_ENGINE_OPTIONS for flask-sqlalchemy, sqlite keeps its own pool
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and backend == 'postgresql':
+        # set by the server at connect time, a rollback cannot undo it
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT_MS}
+    return options
+
+def setup_engine(engine):
+    # mysql has no connect time option for it, the session variable is set on each new connection
+    if DB_STATEMENT_TIMEOUT_MS and engine.dialect.name == 'mysql':
+        event.listen(engine, 'connect', set_mysql_timeout)
+
+def pool_wait_stats():
+    with pool_stats_lock:
+        return dict(pool_stats)
+
+def dispose_after_fork(app, db):
+    # gunicorn forks the workers from the master: a connection opened before the fork must not
+    # be shared by two processes, the child forgets the inherited ones (close=False leaves the
+    # parent's sockets alone) and opens its own
+    def reset_pool():
+        global pool_stats_lock
+        # another thread may have held the lock at fork time, the child only has this one
+        pool_stats_lock = threading.Lock()
+        for name in pool_stats:
+            pool_stats[name] = 0
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset_pool)
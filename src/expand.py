@@ -0,0 +1,74 @@
+"""
+Embedded relationships for the collection endpoints:
+/characters?expand=planet, /likes?expand=planet,character.planet,vehicle,user
+Only the many-to-one relationships of models.py can be expanded. Each one costs a single
+SELECT ... WHERE id IN (...) per page (per batch when streaming), whatever the page size.
+"""
+from functools import lru_cache
+from flask import request
+from sqlalchemy import select
+from sqlalchemy.orm import MANYTOONE
+from utils import APIException, default_fields
+
+# ?expand=character.planet is two levels, nothing deeper is loaded
+MAX_EXPAND_DEPTH = 2
+
+@lru_cache(maxsize=None)
+def relationships(model):
+    # relationship name -> (foreign key column, related model)
+    return dict((relationship.key, (next(iter(relationship.local_columns)).name, relationship.mapper.class_))
+                for relationship in model.__mapper__.relationships if relationship.direction is MANYTOONE)
+
+def get_expand(model, args=None):
+    # ?expand=planet,character.planet -> {'planet': {}, 'character': {'planet': {}}}, None without it
+    raw = (request.args if args is None else args).get('expand')
+    if not raw:
+        return None
+    tree = {}
+    for path in raw.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        names = path.split('.')
+        if len(names) > MAX_EXPAND_DEPTH:
+            raise APIException('Cannot expand more than %d levels: %s' % (MAX_EXPAND_DEPTH, path), status_code=400)
+        node, current = tree, model
+        for name in names:
+            if name not in relationships(current):
+                raise APIException('Cannot expand %s' % path, status_code=400)
+            node = node.setdefault(name, {})
+            current = relationships(current)[name][1]
+    return tree or None
+
+def expanded_models(model, tree):
+    # every table embedded in the response, their changes have to change the ETag too
+    models = []
+    for name, subtree in (tree or {}).items():
+        related = relationships(model)[name][1]
+        models.append(related)
+        models.extend(expanded_models(related, subtree))
+    return models
+
+def expand_fields(fields, model, tree):
+    # the foreign keys of the expanded relationships are selected even when ?fields= leaves them out
+    if not tree:
+        return fields
+    missing = [relationships(model)[name][0] for name in tree]
+    missing = [name for name in missing if name not in fields]
+    return tuple(fields) + tuple(missing) if missing else fields
+
+def expand(connection, model, items, tree):
+    # items are serialized rows, each expanded relationship is set in place, None when unset.
+    # Works with a sync connection, or through AsyncConnection.run_sync
+    for name, subtree in (tree or {}).items():
+        key, related = relationships(model)[name]
+        ids = set(item[key] for item in items if item.get(key) is not None)
+        found = {}
+        if ids:
+            fields = expand_fields(default_fields(related), related, subtree)
+            statement = select(*[getattr(related, field) for field in fields]).where(related.id.in_(ids))
+            found = dict((row.id, dict(zip(fields, row))) for row in connection.execute(statement))
+            expand(connection, related, list(found.values()), subtree)
+        for item in items:
+            item[name] = found.get(item.get(key))
+    return items
@@ -0,0 +1,68 @@
+"""
+Filtering and sorting for the collection endpoints:
+?climate=arid&population__gt=1000000&sort=-diameter
+"""
+from flask import request
+from models import User, Planet, Vehicle, Character, Like
+from utils import APIException, DEFAULT_SORT, coerce_value
+
+# query string parameters that are not filters
+RESERVED_PARAMS = {'after', 'limit', 'fields', 'stream', 'sort', 'ids', 'expand'}
+
+# column__operator -> SQL, a plain column name means equality
+OPERATORS = {
+    'eq': lambda column, value: column == value,
+    'ne': lambda column, value: column != value,
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'in': lambda column, values: column.in_(values),
+}
+
+# only these columns can be filtered or sorted on, each one is backed by an index
+# (see the __table_args__ in models.py)
+FILTER_FIELDS = {
+    User: ('user_name', 'email'),
+    Planet: ('name', 'climate', 'population', 'diameter'),
+    Vehicle: ('name', 'manufacturer', 'cost_in_credits', 'vehicle_class'),
+    Character: ('name', 'gender', 'planet_id', 'birth_year'),
+    Like: ('user_id', 'planet_id', 'character_id', 'vehicle_id'),
+}
+SORT_FIELDS = {
+    User: ('id', 'user_name'),
+    Planet: ('id', 'name', 'population', 'diameter', 'like_count'),
+    Vehicle: ('id', 'name', 'cost_in_credits', 'like_count'),
+    Character: ('id', 'name', 'birth_year', 'like_count'),
+    Like: ('id',),
+}
+
+def get_sort(model, args=None):
+    # ?sort=diameter or ?sort=-diameter, one column, the id breaks ties
+    sort = (request.args if args is None else args).get('sort')
+    if not sort:
+        return DEFAULT_SORT
+    descending = sort.startswith('-')
+    name = sort.lstrip('-')
+    if name not in SORT_FIELDS.get(model, ()):
+        raise APIException('Cannot sort by %s' % name, status_code=400)
+    return name, descending
+
+def apply_filters(query, model, args=None):
+    # args defaults to the flask query string, works on ORM queries and Core selects
+    allowed = FILTER_FIELDS.get(model, ())
+    for param, raw in (request.args if args is None else args).items(multi=True):
+        if param in RESERVED_PARAMS:
+            continue
+        name, _, operator = param.partition('__')
+        operator = operator or 'eq'
+        if name not in allowed or operator not in OPERATORS:
+            raise APIException('Unknown filter: %s' % param, status_code=400)
+        column = getattr(model, name)
+        # values are bound parameters typed after the column, never pasted into the SQL
+        if operator == 'in':
+            value = [coerce_value(column, item) for item in raw.split(',') if item]
+        else:
+            value = coerce_value(column, raw)
+        query = query.filter(OPERATORS[operator](column, value))
+    return query
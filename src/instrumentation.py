@@ -0,0 +1,54 @@
+import os
+import time
+from flask import g, request, current_app, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_query(time.perf_counter() - conn.info['query_start_time'].pop(), statement, 'Slow query')
+
+def handle_error(exception_context):
+    # a statement that raises never reaches after_cursor_execute: its start time has to be
+    # popped here, and the slow failures (statement timeouts) are logged as well
+    connection = exception_context.connection
+    if connection is None or exception_context.statement is None or not connection.info.get('query_start_time'):
+        return
+    elapsed = time.perf_counter() - connection.info['query_start_time'].pop()
+    record_query(elapsed, exception_context.statement, 'Failed query')
+
+def record_query(elapsed, statement, label):
+    if not has_app_context():
+        return
+    # g only exists inside the app context, queries run from the shell or migrations are ignored
+    g.query_count = g.get('query_count', 0) + 1
+    g.query_time = g.get('query_time', 0.0) + elapsed
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        endpoint = request.endpoint if has_request_context() else None
+        current_app.logger.warning('%s (%.1fms) in %s: %s', label, elapsed * 1000, endpoint, statement)
+
+def setup_instrumentation(app):
+    app.config.setdefault('SLOW_QUERY_MS', float(os.environ.get('SLOW_QUERY_MS', 100)))
+
+    # listening on the Engine class covers the engine flask-sqlalchemy creates lazily for db
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+
+    @app.after_request
+    def add_timing_headers(response):
+        # streamed bodies only account for the queries issued before the first byte
+        total = (time.perf_counter() - g.get('request_start_time', time.perf_counter())) * 1000
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+        response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (
+            g.get('query_time', 0.0) * 1000, g.get('query_count', 0), total)
+        return response
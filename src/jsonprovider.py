@@ -0,0 +1,82 @@
+"""
+JSON encoding for responses, request bodies, the cache and the NDJSON streams.
+Uses orjson or msgspec when installed and the standard library otherwise,
+JSON_ENGINE=orjson|msgspec|json picks one explicitly. Keys are sorted and the separators
+compact, as flask's default provider writes them.
+"""
+import os
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def default(value):
+    # what the fast encoders do not know natively, the stdlib one also needs the dates
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+def available_engine():
+    if orjson is not None:
+        return 'orjson'
+    if msgspec is not None:
+        return 'msgspec'
+    return 'json'
+
+JSON_ENGINE = os.environ.get('JSON_ENGINE') or available_engine()
+
+if JSON_ENGINE == 'orjson':
+    # datetimes come out as isoformat, int keys are turned into strings like the stdlib does.
+    # Non-ASCII characters are written as UTF-8, where the stdlib escapes them as \uXXXX
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    def dumps(value):
+        return orjson.dumps(value, default=default, option=ORJSON_OPTIONS)
+
+    loads = orjson.loads
+elif JSON_ENGINE == 'msgspec':
+    encoder = msgspec.json.Encoder(enc_hook=default, order='sorted')
+    decoder = msgspec.json.Decoder()
+    dumps = encoder.encode
+    loads = decoder.decode
+elif JSON_ENGINE == 'json':
+    def dumps(value):
+        return json.dumps(value, default=default, separators=(',', ':'), sort_keys=True).encode()
+
+    loads = json.loads
+else:
+    raise ValueError('Unknown JSON_ENGINE: %s' % JSON_ENGINE)
+
+class FastJSONProvider(JSONProvider):
+    # jsonify, request.json and the error handlers all go through app.json
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        # options such as indent or sort_keys=False are only known to the stdlib encoder
+        if kwargs:
+            kwargs.setdefault('default', default)
+            kwargs.setdefault('sort_keys', True)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # the encoder output is already bytes, hand it to the response without a decode
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import tempfile
+import threading
+from flask import g, request
+from sqlalchemy.pool import QueuePool
+from database import DB_MAX_OVERFLOW
+
+# gunicorn runs one process per worker, each one writes its own snapshot here
+# and /metrics merges every snapshot so the numbers cover the whole server.
+# The gunicorn master empties it on start (gunicorn.conf.py), the totals cover one server run
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'flask-metrics'))
+# the counters of the workers that exited, merged into one file so recycled workers do not pile up
+RETIRED_SNAPSHOT = 'retired.json'
+# seconds between snapshot writes, /metrics always writes the current worker first
+FLUSH_INTERVAL = 1.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_snapshots(directory=METRICS_DIR):
+    # only while no worker runs: in the gunicorn master before it forks, or in tests
+    shutil.rmtree(directory, ignore_errors=True)
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def add_counters(requests, latency, snapshot):
+    for key, value in snapshot['requests'].items():
+        requests[key] = requests.get(key, 0) + value
+    for key, values in snapshot['latency'].items():
+        merged = latency.setdefault(key, [0] * len(values))
+        latency[key] = [a + b for a, b in zip(merged, values)]
+
+def label_string(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+
+class MetricsStore:
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # called again after a fork so a worker never reports its parent's numbers.
+        # A pid can come back in a later worker, the file name is unique to this process
+        self.pid = os.getpid()
+        self.filename = '%d-%s.json' % (self.pid, uuid.uuid4().hex[:8])
+        self.requests = {}
+        self.latency = {}
+        self.in_flight = 0
+        self.gauges = {}
+        self.last_flush = 0.0
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def request_started(self):
+        with self.lock:
+            self.check_fork()
+            self.in_flight += 1
+
+    def request_finished(self, endpoint, method, status, seconds):
+        with self.lock:
+            self.check_fork()
+            self.in_flight -= 1
+            key = '%s|%s|%s' % (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = '%s|%s' % (endpoint, method)
+            buckets = self.latency.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+            else:
+                buckets[len(LATENCY_BUCKETS)] += 1
+            buckets[-1] += seconds
+        self.flush()
+
+    def set_gauges(self, **gauges):
+        with self.lock:
+            self.check_fork()
+            self.gauges.update(gauges)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < FLUSH_INTERVAL:
+            return
+        with self.lock:
+            self.last_flush = now
+            snapshot = {
+                'pid': self.pid,
+                'requests': self.requests,
+                'latency': self.latency,
+                'in_flight': self.in_flight,
+                'gauges': self.gauges,
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, self.filename)
+            # write then rename, readers never see half a file
+            with open(path + '.tmp', 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(path + '.tmp', path)
+
+    def locked(self, mode):
+        # readers share the lock, retire() takes it alone: a snapshot is never counted both in
+        # its own file and in the retired one
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(f, mode)
+        return f
+
+    def collect(self):
+        requests, latency, gauges = {}, {}, {}
+        in_flight = 0
+        dead = []
+        with self.locked(fcntl.LOCK_SH):
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json'):
+                    continue
+                snapshot = read_snapshot(os.path.join(self.directory, filename))
+                if snapshot is None:
+                    continue
+                # counters of dead workers still count, their gauges don't
+                add_counters(requests, latency, snapshot)
+                if filename == RETIRED_SNAPSHOT:
+                    continue
+                if pid_alive(snapshot['pid']):
+                    in_flight += snapshot['in_flight']
+                    for key, value in snapshot['gauges'].items():
+                        gauges[key] = gauges.get(key, 0) + value
+                else:
+                    dead.append(filename)
+        if dead:
+            self.retire(dead)
+        return requests, latency, in_flight, gauges
+
+    def retire(self, filenames):
+        # fold the snapshots of exited workers into RETIRED_SNAPSHOT and remove them
+        with self.locked(fcntl.LOCK_EX):
+            path = os.path.join(self.directory, RETIRED_SNAPSHOT)
+            retired = read_snapshot(path) or {'requests': {}, 'latency': {}}
+            removed = []
+            for filename in filenames:
+                # another worker may have retired it since
+                snapshot = read_snapshot(os.path.join(self.directory, filename))
+                if snapshot is not None:
+                    add_counters(retired['requests'], retired['latency'], snapshot)
+                    removed.append(filename)
+            if not removed:
+                return
+            with open(path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(path + '.tmp', path)
+            for filename in removed:
+                os.remove(os.path.join(self.directory, filename))
+
+    def render(self):
+        self.flush(force=True)
+        requests, latency, in_flight, gauges = self.collect()
+        lines = [
+            '# HELP http_requests_total Requests handled, by endpoint, method and status code.',
+            '# TYPE http_requests_total counter',
+        ]
+        for key in sorted(requests):
+            endpoint, method, status = key.split('|')
+            labels = label_string([('endpoint', endpoint), ('method', method), ('status', status)])
+            lines.append('http_requests_total{%s} %d' % (labels, requests[key]))
+        lines += [
+            '# HELP http_request_duration_seconds Request latency, by endpoint and method.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for key in sorted(latency):
+            endpoint, method = key.split('|')
+            values = latency[key]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values[:-1]):
+                cumulative += count
+                labels = label_string([('endpoint', endpoint), ('method', method), ('le', bound)])
+                lines.append('http_request_duration_seconds_bucket{%s} %d' % (labels, cumulative))
+            labels = label_string([('endpoint', endpoint), ('method', method)])
+            lines.append('http_request_duration_seconds_sum{%s} %f' % (labels, values[-1]))
+            lines.append('http_request_duration_seconds_count{%s} %d' % (labels, cumulative))
+        lines += [
+            '# HELP http_requests_in_flight Requests being handled right now.',
+            '# TYPE http_requests_in_flight gauge',
+            'http_requests_in_flight %d' % in_flight,
+        ]
+        for name in sorted(gauges):
+            lines.append('# TYPE %s %s' % (name, 'counter' if name.endswith('_total') else 'gauge'))
+            lines.append('%s %s' % (name, gauges[name]))
+        return '\n'.join(lines) + '\n'
+
+store = MetricsStore()
+
+# callables returning {name: value}, sampled after every request like the pool gauges
+gauge_callbacks = []
+
+def register_gauges(callback):
+    gauge_callbacks.append(callback)
+
+def pool_gauges(engine):
+    # only QueuePool keeps counters, NullPool and the sqlite pools report 0
+    # checked_out / capacity is the saturation, a worker at capacity queues its requests
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'db_pool_size': 0, 'db_pool_capacity': 0, 'db_pool_checked_out': 0, 'db_pool_overflow': 0}
+    return {
+        'db_pool_size': pool.size(),
+        'db_pool_capacity': pool.size() + max(DB_MAX_OVERFLOW, 0),
+        'db_pool_checked_out': pool.checkedout(),
+        'db_pool_overflow': max(pool.overflow(), 0),
+    }
+
+def setup_metrics(app, db):
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_start_time = time.perf_counter()
+        store.request_started()
+
+    @app.after_request
+    def record_metrics(response):
+        if 'metrics_start_time' in g:
+            store.request_finished(request.endpoint or 'unmatched', request.method, response.status_code,
+                                   time.perf_counter() - g.pop('metrics_start_time'))
+            store.set_gauges(**pool_gauges(db.engine))
+            for callback in gauge_callbacks:
+                store.set_gauges(**callback())
+        return response
+
+    @app.teardown_request
+    def abort_metrics(error=None):
+        # after_request does not run when the request blows up, keep in_flight right anyway
+        if 'metrics_start_time' in g:
+            store.request_finished(request.endpoint or 'unmatched', request.method, 500,
+                                   time.perf_counter() - g.pop('metrics_start_time'))
@@ -1,38 +1,43 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, bindparam, select, func, inspect
+from sqlalchemy.orm import Session, object_session
+from cache import invalidate_on_commit, mark_written
+from utils import serializer
+from replicas import RoutingSession
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
    
 class User(db.Model):
     __tablename__ = 'user'
     id = db.Column(db.Integer, primary_key=True)
-    user_name = db.Column(db.String(50), nullable=False)
+    user_name = db.Column(db.String(50), nullable=False, unique=True, index=True)
     password = db.Column(db.String(50))
     name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50))
-    email = db.Column(db.String(50),nullable=False)
+    email = db.Column(db.String(50),nullable=False, unique=True, index=True)
     phone = db.Column(db.Integer,nullable=False) 
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     like = db.relationship('Like',backref='user',lazy=True)
 
     def __repr__(self):
         return '<User %r>' % self.id
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "user_name": self.user_name,
-            "name": self.name,
-            "last_name": self.last_name,
-            "email": self.email,
-            "phone": self.phone,
-
-            # do not serialize the password, its a security breach
-        }
+        # generated from the columns, the password is in HIDDEN_FIELDS
+        return serializer(User)(self)
 
 class Planet(db.Model):
     __tablename__ = 'planet'
+    # composite indexes behind the filters and sort orders in filters.py
+    __table_args__ = (
+        db.Index('ix_planet_climate_population', 'climate', 'population'),
+        db.Index('ix_planet_population_id', 'population', 'id'),
+        db.Index('ix_planet_diameter_id', 'diameter', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(50), nullable=False, unique=True, index=True)
     climate = db.Column(db.String(50),nullable=False)
     terrain = db.Column(db.String(50),nullable=False)
     population = db.Column(db.Integer,nullable=False)
@@ -41,6 +46,8 @@ class Planet(db.Model):
     orbital_period= db.Column(db.Integer,nullable=False)
     diameter = db.Column(db.Integer, nullable=False)
     surface_water = db.Column(db.Integer, nullable=False) 
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     character = db.relationship('Character', backref='planet',lazy=True)
     like = db.relationship('Like', backref='planet',lazy=True)
 
@@ -48,24 +55,18 @@ class Planet(db.Model):
         return '<Planet %r>' % self.id
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "climate": self.climate,
-            "terrain": self.terrain,
-            "population": self.population,
-            "gravity": self.gravity,
-            "rotation_period": self.rotation_period,
-            "orbital_period": self.orbital_period,
-            "diameter": self.diameter,
-            "surface_water": self.surface_water,         
-            # do not serialize the password, its a security breach
-        }
+        return serializer(Planet)(self)
 
 class Vehicle(db.Model):
     __tablename__ = 'vehicle'
+    # composite indexes behind the filters and sort orders in filters.py
+    __table_args__ = (
+        db.Index('ix_vehicle_manufacturer_cost_in_credits', 'manufacturer', 'cost_in_credits'),
+        db.Index('ix_vehicle_vehicle_class_cost_in_credits', 'vehicle_class', 'cost_in_credits'),
+        db.Index('ix_vehicle_cost_in_credits_id', 'cost_in_credits', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(50), nullable=False, unique=True, index=True)
     model = db.Column(db.String(50), nullable=False)
     manufacturer = db.Column(db.String(50), nullable=False)
     cost_in_credits = db.Column(db.Integer, nullable=False)
@@ -76,32 +77,25 @@ class Vehicle(db.Model):
     cargo_capacity = db.Column(db.Integer, nullable=False)
     consumables = db.Column(db.String(50), nullable=False)
     vehicle_class = db.Column(db.String(50), nullable=False)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     like = db.relationship('Like', backref='vehicle',lazy=True)
 
     def __repr__(self):
         return '<Vehicle %r>' % self.id
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "model": self.model,
-            "manufacturer": self.manufacturer,
-            "cost_in_credits": self.cost_in_credits,
-            "length": self.length,
-            "max_atmosphering_speed": self.max_atmosphering_speed,
-            "crew": self.crew,
-            "passenger": self.passenger,
-            "cargo_capacity": self.cargo_capacity,
-            "consumables": self.consumables,
-            "vehicle_class": self.vehicle_class
-            # do not serialize the password, its a security breach
-        }
+        return serializer(Vehicle)(self)
 
 class Character(db.Model):
     __tablename__ = 'character'
+    # composite indexes behind the filters and sort orders in filters.py
+    __table_args__ = (
+        db.Index('ix_character_gender_birth_year', 'gender', 'birth_year'),
+        db.Index('ix_character_birth_year_id', 'birth_year', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(50), nullable=False, unique=True, index=True)
     height = db.Column(db.Integer, nullable=False)
     mass = db.Column(db.Integer, nullable=False)
     hair_color = db.Column(db.String(50),nullable=False)
@@ -109,44 +103,124 @@ class Character(db.Model):
     eye_color = db.Column(db.String(50), nullable=False)
     birth_year = db.Column(db.DateTime, nullable=False)
     gender = db.Column(db.String(50), nullable=False)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'))
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), index=True)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     like = db.relationship('Like', backref='character',lazy=True)
 
     def __repr__(self):
         return '<User %r>' % self.id
 
     def serialize(self):
-        return {
-            "id":self.id,
-            "name":self.name,
-            "height":self.height,
-            "mass":self.mass,
-            "hair_color":self.hair_color,
-            "skin_color":self.skin_color,
-            "eye_color":self.eye_color,
-            "birth_year":self.birth_year.isoformat(),
-            "gender":self.gender,
-            "planet_id":self.planet_id
-            # do not serialize the password, its a security breach
-        }
+        return serializer(Character)(self)
 
 class Like(db.Model):
     __tablename__ = 'like'
     id = db.Column(db.Integer, primary_key=True)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'),nullable=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'),nullable=True)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'),nullable=True)
-    user_id = db.Column(db.Integer,db.ForeignKey('user.id'),nullable=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'),nullable=True, index=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'),nullable=True, index=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'),nullable=True, index=True)
+    user_id = db.Column(db.Integer,db.ForeignKey('user.id'),nullable=True, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return '<User %r>' % self.id
 
     def serialize(self):
-        return {
-            "id":self.id,
-            "planet_id":self.planet_id,
-            "character_id":self.character_id,
-            "vehicle_id":self.vehicle_id,
-            "user_id":self.user_id,
-            # do not serialize the password, its a security breach
-        }
\ No newline at end of file
+        return serializer(Like)(self)
+
+# url prefix -> model, shared by the bulk routes and the ASGI entry point
+RESOURCES = {
+    'users': User,
+    'planets': Planet,
+    'vehicles': Vehicle,
+    'characters': Character,
+    'likes': Like,
+}
+
+# like_count on planet, character and vehicle is a denormalized COUNT(*) of their likes
+LIKE_COUNTERS = {
+    'planet_id': Planet,
+    'character_id': Character,
+    'vehicle_id': Vehicle,
+}
+
+def apply_like_deltas(connection, session, deltas):
+    # deltas: {(model, id): change}, one executemany UPDATE per table in the caller's transaction
+    for model in LIKE_COUNTERS.values():
+        params = [{'b_id': entity_id, 'b_delta': delta}
+                  for (target, entity_id), delta in deltas.items() if target is model and delta]
+        if not params:
+            continue
+        table = model.__table__
+        connection.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(like_count=table.c.like_count + bindparam('b_delta')),
+            params)
+        for param in params:
+            invalidate_on_commit(session, model.__tablename__, param['b_id'])
+
+def like_deltas(rows, sign):
+    deltas = {}
+    for row in rows:
+        for name, model in LIKE_COUNTERS.items():
+            if row.get(name) is not None:
+                key = (model, row[name])
+                deltas[key] = deltas.get(key, 0) + sign
+    return deltas
+
+def rebuild_like_counts():
+    # repair: recount every counter from the like table, one UPDATE per table
+    for name, model in LIKE_COUNTERS.items():
+        like = Like.__table__
+        count = select(func.count(like.c.id)).where(like.c[name] == model.__table__.c.id).scalar_subquery()
+        db.session.execute(model.__table__.update().values(like_count=count))
+        mark_written(db.session, model.__tablename__)
+    db.session.commit()
+
+@event.listens_for(Like, 'after_insert')
+def count_new_like(mapper, connection, target):
+    row = dict((name, getattr(target, name)) for name in LIKE_COUNTERS)
+    apply_like_deltas(connection, object_session(target), like_deltas([row], 1))
+
+@event.listens_for(Like, 'after_delete')
+def count_deleted_like(mapper, connection, target):
+    row = dict((name, getattr(target, name)) for name in LIKE_COUNTERS)
+    apply_like_deltas(connection, object_session(target), like_deltas([row], -1))
+
+@event.listens_for(Like, 'after_update')
+def count_updated_like(mapper, connection, target):
+    deltas = {}
+    state = inspect(target)
+    for name, model in LIKE_COUNTERS.items():
+        history = state.attrs[name].history
+        if not history.has_changes():
+            continue
+        for value in history.deleted:
+            if value is not None:
+                deltas[(model, value)] = deltas.get((model, value), 0) - 1
+        for value in history.added:
+            if value is not None:
+                deltas[(model, value)] = deltas.get((model, value), 0) + 1
+    apply_like_deltas(connection, object_session(target), deltas)
+
+class TableVersion(db.Model):
+    # one row per table of RESOURCES, bumped by every transaction that writes to the table.
+    # The collection ETags are built from it: the row lock orders the writers so the version
+    # follows the commit order, and reading it is a primary key lookup instead of a scan
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def create_table_versions(table, connection, **kw):
+    connection.execute(table.insert(), [{'name': model.__tablename__, 'version': 0} for model in RESOURCES.values()])
+
+@event.listens_for(Session, 'before_commit')
+def bump_table_versions(session):
+    # flushed first so the last flush is counted too, then one UPDATE in name order:
+    # the rows stay locked only while the transaction commits
+    session.flush()
+    tables = session.info.pop('written', None)
+    if tables:
+        table = TableVersion.__table__
+        session.execute(table.update().where(table.c.name.in_(sorted(tables))).values(version=table.c.version + 1))
@@ -0,0 +1,144 @@
+"""
+Read replica routing: DATABASE_REPLICA_URLS=postgresql://replica1/db,postgresql://replica2/db
+GET and HEAD requests read from a replica, round robin over the healthy ones. Everything
+else, and every request a client sends within DB_STICKY_SECONDS of one of its writes,
+stays on the primary.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, create_engine
+from database import engine_options, setup_engine
+
+logger = logging.getLogger(__name__)
+
+REPLICA_URLS = [url.strip().replace("postgres://", "postgresql://")
+                for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# after a write the client reads its own writes from the primary for this long
+DB_STICKY_SECONDS = float(os.environ.get('DB_STICKY_SECONDS', 5))
+# seconds between two health checks of a replica, and before a failed one is tried again
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
+READ_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'db_primary_until'
+
+class ReplicaRouter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
+        self.keys = []
+        self.position = 0
+        # key -> [healthy, checked_at]
+        self.health = {}
+
+    def setup(self, urls):
+        # the replicas get the same pool settings as the primary, they are not flask-sqlalchemy
+        # binds so create_all and the migrations never touch them
+        for index, url in enumerate(urls):
+            key = 'replica_%d' % index
+            engine = create_engine(url, **engine_options(url))
+            setup_engine(engine)
+            event.listen(engine, 'handle_error', lambda context, key=key: self.connection_error(key, context))
+            self.engines[key] = engine
+            self.health[key] = [True, 0.0]
+        self.keys = sorted(self.engines)
+        os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def reset_after_fork(self):
+        # same as the primary pool in wsgi.py, a worker never uses its parent's connections
+        self.lock = threading.Lock()
+        for engine in self.engines.values():
+            engine.dispose(close=False)
+
+    def connection_error(self, key, context):
+        # a lost connection takes the replica out of the rotation until its next check
+        if context.is_disconnect:
+            self.mark(key, False)
+
+    def mark(self, key, healthy):
+        with self.lock:
+            if self.health[key][0] and not healthy:
+                logger.warning('Replica %s is down, reading from the others', key)
+            self.health[key] = [healthy, time.monotonic()]
+
+    def check(self, key, engine):
+        with self.lock:
+            healthy, checked_at = self.health[key]
+            if time.monotonic() - checked_at < DB_REPLICA_CHECK_INTERVAL:
+                return healthy
+            # claim the check so concurrent requests don't all ping the same replica
+            self.health[key][1] = time.monotonic()
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+        except Exception as e:
+            logger.warning('Replica %s health check failed: %s', key, e)
+            self.mark(key, False)
+            return False
+        self.mark(key, True)
+        return True
+
+    def pick(self):
+        # next healthy replica in the rotation, None sends the read to the primary
+        with self.lock:
+            start = self.position
+            self.position = (self.position + 1) % len(self.keys)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            if self.check(key, self.engines[key]):
+                return self.engines[key]
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {'db_replicas_healthy': sum(1 for healthy, _ in self.health.values() if healthy)}
+
+router = ReplicaRouter()
+
+def use_primary():
+    # the rest of the request reads from the primary
+    if has_request_context():
+        g.db_primary = True
+
+def reads_from_replica():
+    return (has_request_context() and request.method in READ_METHODS
+            and not g.get('db_primary', False))
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # one replica per request, so its queries all see the same snapshot;
+        # flushes and sessions that already wrote always go to the primary
+        if bind is None and router.keys and not self._flushing and not self.info.get('wrote') and reads_from_replica():
+            if 'db_replica' not in g:
+                g.db_replica = router.pick()
+            if g.db_replica is not None:
+                return g.db_replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def remember_write(session, flush_context):
+    session.info['wrote'] = True
+
+def setup_replicas(app):
+    if not REPLICA_URLS:
+        return
+    router.setup(REPLICA_URLS)
+
+    @app.before_request
+    def stick_to_primary():
+        try:
+            g.db_primary = float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            g.db_primary = False
+
+    @app.after_request
+    def remember_primary(response):
+        if request.method not in READ_METHODS and request.method != 'OPTIONS' and response.status_code < 400 and DB_STICKY_SECONDS > 0:
+            response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + DB_STICKY_SECONDS),
+                                max_age=math.ceil(DB_STICKY_SECONDS), httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,257 @@
+"""
+Declarative resources: the list, detail, create, update, delete, top and bulk routes of
+every model are built here from its columns, so pagination, projection, ETags, caching and
+bulk writes have a single implementation shared by all of them.
+"""
+from flask import request, jsonify
+from sqlalchemy import select, exists
+from sqlalchemy.exc import IntegrityError
+from utils import (APIException, paginate, wants_stream, stream_ndjson, get_fields, project, serialize, serializer,
+                   collection_etag, collection_headers, entity_etag, not_modified, etag_header, unique_violation, get_page_size,
+                   default_fields, read_rows, get_ids, order_by_ids)
+from cache import entity_cache, pick
+from models import db, User, Planet, Vehicle, Character, Like
+from bulk import bulk_create, bulk_update, bulk_delete, writable_fields, clean_item
+from filters import apply_filters, get_sort
+from replicas import use_primary
+from expand import get_expand, expand_fields, expanded_models, expand
+
+# default size of the /<resource>/top leaderboards
+TOP_PAGE_SIZE = 10
+
+def server_error(e):
+    return jsonify({'message':'Internal Server Error','error':str(e)}),500
+
+def get_bulk_items():
+    # accept a plain list or {"items": [...]}
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list):
+        raise APIException('Request body must be a list of items', status_code=400)
+    return items
+
+def missing_references(session, model, row):
+    # one SELECT with an EXISTS per foreign key set in the row, returns the missing tables.
+    # session is db.session, or the sync side of an AsyncSession through run_sync
+    checks = []
+    for column in model.__table__.columns:
+        for foreign_key in column.foreign_keys:
+            if row.get(column.name) is not None:
+                checks.append((foreign_key.column.table.name, exists().where(foreign_key.column == row[column.name])))
+    if not checks:
+        return []
+    found = session.execute(select(*[check for _, check in checks])).one()
+    return [table for (table, _), ok in zip(checks, found) if not ok]
+
+class Resource:
+
+    def __init__(self, name, model, top=False, immutable=()):
+        # name is the url prefix, top adds /<name>/top ordered by like_count,
+        # immutable fields can be set on create but never changed by an update
+        self.name = name
+        self.model = model
+        self.label = model.__name__
+        self.singular = model.__tablename__
+        self.top = top
+        # everything a request needs is worked out once here, not on every call
+        self.fields = default_fields(model)
+        self.serialize = serializer(model)
+        self.create_fields = writable_fields(model)
+        self.immutable = tuple(immutable)
+        self.update_fields = tuple(name for name in self.create_fields if name not in immutable)
+        self.not_found = '%s not found' % self.label
+        self.write_keys = {'created': self.singular + '_created', 'updated': 'updated_' + self.singular}
+
+    def register(self, app):
+        prefix = '/' + self.name
+        app.add_url_rule(prefix, 'get_' + self.name, self.list, methods=['GET'])
+        if self.top:
+            app.add_url_rule(prefix + '/top', 'get_top_' + self.name, self.top_items, methods=['GET'])
+        app.add_url_rule(prefix + '/<int:id>', 'get_%s_id' % self.singular, self.detail, methods=['GET'])
+        app.add_url_rule(prefix, 'create_' + self.singular, self.create, methods=['POST'])
+        app.add_url_rule(prefix + '/<int:id>', 'update_' + self.singular, self.update, methods=['PUT'])
+        app.add_url_rule(prefix + '/<int:id>', 'delete_' + self.singular, self.delete, methods=['DELETE'])
+        for method, action, operation, args in (('POST', 'create', bulk_create, ()),
+                                                ('PUT', 'update', bulk_update, (self.update_fields, self.immutable)),
+                                                ('DELETE', 'delete', bulk_delete, ())):
+            app.add_url_rule(prefix + '/bulk', 'bulk_%s_%s' % (action, self.name),
+                             lambda operation=operation, args=args: self.bulk(operation, *args), methods=[method])
+
+    def embed(self, items, tree):
+        # ?expand=, one IN query per relationship for the whole page
+        if tree:
+            expand(db.session.connection(), self.model, items, tree)
+        return items
+
+    def list(self):
+        model = self.model
+        try:
+            sort = get_sort(model)
+            tree = get_expand(model)
+            fields = expand_fields(get_fields(model, sort) or self.fields, model, tree)
+            ids = get_ids()
+            stream = ids is None and wants_stream()
+            etag = collection_etag(model, expanded_models(model, tree), stream)
+            headers = collection_headers(etag)
+            if not_modified(etag):
+                return '', 304, headers
+            query = project(apply_filters(model.query, model), model, fields)
+            if ids is not None:
+                #multi-get, one query for every id instead of one request each
+                rows, missing = order_by_ids(read_rows(query.filter(model.id.in_(ids))), ids)
+                results = self.embed([serialize(row, fields) for row in rows], tree)
+                return jsonify({"msg": "ok", "results": results, "missing": missing}), 200, headers
+            if stream:
+                transform = (lambda items: self.embed(items, tree)) if tree else None
+                return stream_ndjson(query, model, fields, sort, transform), 200, headers
+            rows, next_cursor = paginate(query, model, sort)
+            response_body = {
+                "msg": "ok",
+                "results": self.embed([serialize(row, fields) for row in rows], tree),
+                "next_cursor": next_cursor
+            }
+            return jsonify(response_body), 200, headers
+        except APIException:
+            raise
+        except Exception as e:
+            return server_error(e)
+
+    def top_items(self):
+        #most liked first, served from the like_count index
+        model = self.model
+        try:
+            tree = get_expand(model)
+            fields = expand_fields(get_fields(model) or self.fields, model, tree)
+            query = project(model.query, model, fields).order_by(model.like_count.desc(), model.id).limit(get_page_size(TOP_PAGE_SIZE))
+            return jsonify({"msg": "ok", "results": self.embed([serialize(row, fields) for row in read_rows(query)], tree)}), 200
+        except APIException:
+            raise
+        except Exception as e:
+            return server_error(e)
+
+    def detail(self, id):
+        model = self.model
+        try:
+            fields = get_fields(model)
+            #read through the entity cache, writes invalidate it on commit
+            cached = entity_cache.get(model, id)
+            if cached is None:
+                #a lagging replica would pin a stale row in the cache for the whole TTL
+                use_primary()
+                item = model.query.get(id)
+                if item is None:
+                    return jsonify({'error':self.not_found}),404
+                cached = {'version': item.updated_at.isoformat(), 'result': self.serialize(item)}
+                entity_cache.add(model, id, cached)
+            etag = entity_etag(model, id, cached['version'], fields)
+            if not_modified(etag):
+                return '', 304, etag_header(etag)
+            return jsonify({"msg": "ok", "result": pick(cached, fields)}), 200, etag_header(etag)
+        except APIException:
+            raise
+        except Exception as e:
+            return server_error(e)
+
+    def missing_error(self, session, row):
+        # the 404 message of the first foreign key in the row that points nowhere, None if all exist
+        missing = missing_references(session, self.model, row)
+        return '%s not found' % missing[0].capitalize() if missing else None
+
+    def saved(self, item, verb):
+        # response body of a create or an update, verb is 'created' or 'updated'
+        return {'message':'%s %s successfully' % (self.label, verb), self.write_keys[verb]: self.serialize(item)}
+
+    def write(self, item, row, status, verb):
+        # shared by create and update: foreign keys in one query, natural keys by the unique indexes
+        error = self.missing_error(db.session, row)
+        if error:
+            return jsonify({'error':error}),404
+        for name, value in row.items():
+            setattr(item, name, value)
+        db.session.add(item)
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            #the unique indexes enforce the natural keys, race free across workers
+            db.session.rollback()
+            if unique_violation(e):
+                return jsonify({'error':'%s already exists' % self.label}),409
+            raise
+        return jsonify(self.saved(item, verb)),status
+
+    def clean(self, body, fields, updating=False):
+        if not isinstance(body, dict):
+            raise APIException('Request body must be an object', status_code=400)
+        row, error = clean_item(self.model, body, fields, updating=updating)
+        if error:
+            raise APIException(error, status_code=400)
+        row.pop('id', None)
+        return row
+
+    def check_immutable(self, item, body):
+        # sending the current value back is fine, a full object can be PUT as it was read
+        if isinstance(body, dict):
+            changed = [name for name in self.immutable if name in body and body[name] != getattr(item, name)]
+            if changed:
+                raise APIException('%s cannot be changed' % ', '.join(changed), status_code=400)
+
+    def update_row(self, item, body):
+        # the validated changes of a PUT on item, immutable fields may only repeat their value
+        self.check_immutable(item, body)
+        return self.clean(dict(body, id=item.id) if isinstance(body, dict) else body, self.update_fields, updating=True)
+
+    def create(self):
+        try:
+            row = self.clean(request.get_json(silent=True), self.create_fields)
+            return self.write(self.model(), row, 201, 'created')
+        except APIException as e:
+            return jsonify({'error':e.message}),e.status_code
+        except Exception as e:
+            return server_error(e)
+
+    def update(self, id):
+        try:
+            item = self.model.query.get(id)
+            if item is None:
+                return jsonify({'error':self.not_found + '.'}),404
+            row = self.update_row(item, request.get_json(silent=True))
+            return self.write(item, row, 200, 'updated')
+        except APIException as e:
+            return jsonify({'error':e.message}),e.status_code
+        except Exception as e:
+            return server_error(e)
+
+    def delete(self, id):
+        try:
+            item = self.model.query.get(id)
+            if item is None:
+                return jsonify({'error':self.not_found}),404
+            db.session.delete(item)
+            db.session.commit()
+            return jsonify({'message':'%s deleted successfully.' % self.label}),200
+        except Exception as e:
+            return server_error(e)
+
+    def bulk(self, operation, *args):
+        items = get_bulk_items()
+        try:
+            return jsonify(operation(self.model, items, *args)),200
+        except IntegrityError as e:
+            #a concurrent writer took a natural key between the batch check and the commit
+            db.session.rollback()
+            if unique_violation(e):
+                return jsonify({'error':'Duplicated item, nothing was written','message':str(e.orig)}),409
+            return server_error(e)
+        except Exception as e:
+            db.session.rollback()
+            return server_error(e)
+
+# every resource of the api, registered on the flask app by app.py and served by asgi.py
+API_RESOURCES = dict((resource.name, resource) for resource in (
+    Resource('users', User, immutable=('user_name',)),
+    Resource('planets', Planet, top=True),
+    Resource('vehicles', Vehicle, top=True),
+    Resource('characters', Character, top=True),
+    Resource('likes', Like),
+))
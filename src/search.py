@@ -0,0 +1,136 @@
+"""
+Full text search over planets, characters and vehicles.
+SQLite keeps an FTS5 table in sync from the mapper events below, Postgres searches
+the expression GIN indexes created by migration 7a2c4e6b8d10 and needs no upkeep.
+"""
+import re
+from sqlalchemy import event, text, func, literal, literal_column, union_all, select, or_
+from models import db, Planet, Character, Vehicle
+
+# columns searched for each type, the name weighs the most
+SEARCH_FIELDS = {
+    Planet: ('name', 'climate', 'terrain'),
+    Character: ('name', 'gender', 'hair_color', 'skin_color', 'eye_color'),
+    Vehicle: ('name', 'model', 'manufacturer', 'vehicle_class'),
+}
+SEARCH_TYPES = {
+    'planet': Planet,
+    'character': Character,
+    'vehicle': Vehicle,
+}
+# the FTS rowid is id * 4 + code, so a row is found again without a scan
+KIND_CODES = {
+    Planet: 1,
+    Character: 2,
+    Vehicle: 3,
+}
+FTS_TABLE = 'search_index'
+MAX_TERMS = 8
+
+def search_terms(q):
+    return re.findall(r'\w+', q)[:MAX_TERMS]
+
+def ensure_fts(connection):
+    if connection.info.get('fts_ready'):
+        return
+    connection.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(name, body)' % FTS_TABLE))
+    connection.info['fts_ready'] = True
+
+def index_rows(connection, model, rows):
+    # rows: objects or Row tuples with the id and the SEARCH_FIELDS of the model
+    if connection.dialect.name != 'sqlite' or not rows:
+        return
+    ensure_fts(connection)
+    name, *others = SEARCH_FIELDS[model]
+    params = [{
+        'rowid': row.id * 4 + KIND_CODES[model],
+        'name': getattr(row, name),
+        'body': ' '.join(str(getattr(row, field)) for field in others),
+    } for row in rows]
+    connection.execute(text('DELETE FROM %s WHERE rowid = :rowid' % FTS_TABLE), params)
+    connection.execute(text('INSERT INTO %s (rowid, name, body) VALUES (:rowid, :name, :body)' % FTS_TABLE), params)
+
+def unindex_ids(connection, model, ids):
+    if connection.dialect.name != 'sqlite' or not ids:
+        return
+    ensure_fts(connection)
+    connection.execute(text('DELETE FROM %s WHERE rowid = :rowid' % FTS_TABLE),
+                       [{'rowid': entity_id * 4 + KIND_CODES[model]} for entity_id in ids])
+
+def reindex(connection, model, column, values):
+    # used by the bulk routes, whose Core statements skip the mapper events
+    if connection.dialect.name != 'sqlite' or not values:
+        return
+    columns = [model.id] + [getattr(model, field) for field in SEARCH_FIELDS[model]]
+    rows = connection.execute(select(*columns).where(column.in_(values))).all()
+    index_rows(connection, model, rows)
+
+def rebuild_search_index():
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    ensure_fts(connection)
+    connection.execute(text('DELETE FROM %s' % FTS_TABLE))
+    for model in SEARCH_FIELDS:
+        columns = [model.id] + [getattr(model, field) for field in SEARCH_FIELDS[model]]
+        index_rows(connection, model, connection.execute(select(*columns)).all())
+    db.session.commit()
+
+def search_document(model):
+    # must stay identical to the indexed expression in the migration
+    parts = [getattr(model, field) for field in SEARCH_FIELDS[model]]
+    document = parts[0]
+    for part in parts[1:]:
+        document = document.op('||')(literal_column("' '")).op('||')(part)
+    return func.to_tsvector(literal_column("'simple'"), document)
+
+def search(models, q, limit, offset=0):
+    # returns [(model, id, score)], best match first
+    terms = search_terms(q)
+    if not terms:
+        return []
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        ensure_fts(connection)
+        codes = dict((KIND_CODES[model], model) for model in models)
+        match = ' '.join('"%s"*' % term for term in terms)
+        # bm25 is lower for better matches, the name column counts ten times the rest
+        rows = connection.execute(text(
+            'SELECT rowid, -bm25(%s, 10.0, 1.0) AS score FROM %s WHERE %s MATCH :match AND rowid %% 4 IN (%s) '
+            'ORDER BY score DESC LIMIT :limit OFFSET :offset'
+            % (FTS_TABLE, FTS_TABLE, FTS_TABLE, ','.join(str(code) for code in codes))),
+            {'match': match, 'limit': limit, 'offset': offset}).all()
+        return [(codes[rowid % 4], rowid // 4, score) for rowid, score in rows]
+    # postgres: prefix tsquery on the GIN tsvector index, trigram similarity on the name for typos
+    tsquery = func.to_tsquery(literal_column("'simple'"), ' & '.join('%s:*' % term for term in terms))
+    selects = []
+    for model in models:
+        document = search_document(model)
+        score = func.ts_rank(document, tsquery) + func.similarity(model.name, q)
+        selects.append(select(literal(KIND_CODES[model]).label('kind'), model.id.label('id'), score.label('score'))
+                       .where(or_(document.op('@@')(tsquery), model.name.op('%')(q))))
+    ranked = union_all(*selects).subquery()
+    rows = connection.execute(select(ranked).order_by(ranked.c.score.desc(), ranked.c.id).limit(limit).offset(offset)).all()
+    codes = dict((KIND_CODES[model], model) for model in models)
+    return [(codes[kind], entity_id, score) for kind, entity_id, score in rows]
+
+def include_object(object, name, type_, reflected, compare_to):
+    # the search tables and indexes live only in the migrations, keep autogenerate from dropping them
+    if not reflected or name is None:
+        return True
+    if type_ == 'table':
+        return not name.startswith(FTS_TABLE)
+    if type_ == 'index':
+        return not (name.endswith('_search') or name.endswith('_name_trgm'))
+    return True
+
+def index_entity(mapper, connection, target):
+    index_rows(connection, mapper.class_, [target])
+
+def unindex_entity(mapper, connection, target):
+    unindex_ids(connection, mapper.class_, [target.id])
+
+for searchable in SEARCH_FIELDS:
+    event.listen(searchable, 'after_insert', index_entity)
+    event.listen(searchable, 'after_update', index_entity)
+    event.listen(searchable, 'after_delete', unindex_entity)
@@ -1,4 +1,31 @@
-from flask import jsonify, url_for
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+from flask import jsonify, url_for, request, Response, stream_with_context
+from sqlalchemy import select, or_, and_
+from werkzeug.http import quote_etag
+from jsonprovider import dumps
+
+# keyset pagination defaults, every collection endpoint uses them
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# full table exports are streamed as one JSON document per line
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 1000
+# ?ids=1,5,9 multi-get, ids resolved per request with one WHERE id IN (...)
+MAX_IDS = 100
+# columns that never leave the API, see the models serialize() methods
+HIDDEN_FIELDS = {'password'}
+# columns the server maintains, clients can read them but never write them
+READ_ONLY_FIELDS = {'id', 'updated_at', 'like_count'}
+# columns left out of the default representation, ?fields= can still ask for them
+INTERNAL_FIELDS = {'updated_at'}
+# (column, descending), the id always breaks ties so the order is total
+DEFAULT_SORT = ('id', False)
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +42,254 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def encode_cursor(last_id, sort_value=None):
+    # the cursor is opaque for the clients, they only have to send it back in ?after=
+    if sort_value is None:
+        raw = 'id:%d' % last_id
+    else:
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        raw = 'k:' + json.dumps([sort_value, last_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    # returns (sort_value, last_id), plain ids are accepted too so ?after=<id> keeps working
+    # isdigit alone accepts '²', which int() rejects
+    if cursor.isascii() and cursor.isdigit():
+        return None, int(cursor)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        prefix, value = raw.split(':', 1)
+        if prefix == 'id':
+            return None, int(value)
+        if prefix == 'k':
+            sort_value, last_id = json.loads(value)
+            return sort_value, int(last_id)
+        raise ValueError(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+def coerce_value(column, value):
+    # query string and cursor values arrive as text, convert them with the declared column type
+    python_type = column.type.python_type
+    try:
+        if python_type is datetime:
+            return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+        return python_type(value)
+    except (TypeError, ValueError):
+        raise APIException('Invalid value for %s: %s' % (column.name, value), status_code=400)
+
+def keyset(query, model, sort=DEFAULT_SORT, args=None):
+    # WHERE (sort, id) is after the cursor, ORDER BY sort, id: every page costs the same
+    # no matter how deep the client goes, as long as (sort, id) is indexed.
+    # args defaults to the flask query string, works on ORM queries and Core selects
+    name, descending = sort
+    column = getattr(model, name)
+    after = (request.args if args is None else args).get('after')
+    if after:
+        sort_value, last_id = decode_cursor(after)
+        after_id = model.id < last_id if descending else model.id > last_id
+        if name == 'id':
+            query = query.filter(after_id)
+        elif sort_value is None:
+            raise APIException('The cursor does not match the sort order', status_code=400)
+        else:
+            value = coerce_value(column, sort_value)
+            after_value = column < value if descending else column > value
+            query = query.filter(or_(after_value, and_(column == value, after_id)))
+    if name == 'id':
+        return query.order_by(model.id.desc() if descending else model.id)
+    if descending:
+        return query.order_by(column.desc(), model.id.desc())
+    return query.order_by(column, model.id)
+
+def get_page_size(default=DEFAULT_PAGE_SIZE, args=None):
+    limit = (request.args if args is None else args).get('limit', default)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be greater than 0', status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+def get_ids(args=None):
+    # ?ids=1,5,9 -> [1, 5, 9], repeats dropped and the order kept, None without ?ids=
+    raw = (request.args if args is None else args).get('ids')
+    if raw is None:
+        return None
+    ids = []
+    for value in raw.split(','):
+        value = value.strip()
+        if not value:
+            continue
+        if not (value.isascii() and value.isdigit()):
+            raise APIException('Invalid id: %s' % value, status_code=400)
+        ids.append(int(value))
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise APIException('ids must not be empty', status_code=400)
+    if len(ids) > MAX_IDS:
+        raise APIException('At most %d ids per request' % MAX_IDS, status_code=400)
+    return ids
+
+def order_by_ids(rows, ids):
+    # the rows of a WHERE id IN (...) in the requested order, and the ids that matched nothing
+    found = dict((row.id, row) for row in rows)
+    return [found[item_id] for item_id in ids if item_id in found], [item_id for item_id in ids if item_id not in found]
+
+def paginate(query, model, sort=DEFAULT_SORT):
+    limit = get_page_size()
+    # ask for one extra row to know if there is a next page without a COUNT(*)
+    items = read_rows(keyset(query, model, sort).limit(limit + 1)).all()
+    return page(items, limit, sort)
+
+def page(items, limit, sort=DEFAULT_SORT):
+    # items holds up to limit + 1 rows, the extra one only says there is a next page
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(last.id, None if sort[0] == 'id' else getattr(last, sort[0]))
+    return items, next_cursor
+
+def public_columns(model):
+    return [column.name for column in model.__table__.columns if column.name not in HIDDEN_FIELDS]
+
+def default_fields(model):
+    return tuple(name for name in public_columns(model) if name not in INTERNAL_FIELDS)
+
+def get_fields(model, sort=DEFAULT_SORT, args=None):
+    # ?fields=id,name -> ['id', 'name'], None when the client wants every field
+    fields = (request.args if args is None else args).get('fields')
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    allowed = public_columns(model)
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise APIException('Unknown fields: ' + ', '.join(unknown), status_code=400)
+    # the id and the sort column are always returned, pagination needs them for the cursor
+    if 'id' not in names:
+        names.insert(0, 'id')
+    if sort[0] not in names:
+        names.append(sort[0])
+    return names
+
+def project(query, model, fields):
+    # push the projection down to the SELECT instead of loading the whole entity
+    if fields is None:
+        return query
+    return query.with_entities(*[getattr(model, name) for name in fields])
+
+@lru_cache(maxsize=None)
+def serializer(model, fields=None):
+    # built once per model (and per ?fields= tuple) from the table columns. Loaded values are
+    # read straight from the instance dict, 4x faster than the instrumented attributes,
+    # datetimes are left as they are for the JSON encoder
+    names = fields or default_fields(model)
+    loaded = itemgetter(*names)
+    getter = attrgetter(*names)
+    if len(names) == 1:
+        loaded = lambda values, get=loaded: (get(values),)
+        getter = lambda item, get=getter: (get(item),)
+
+    def serialize_item(item):
+        try:
+            values = loaded(item.__dict__)
+        except (KeyError, AttributeError):
+            # expired or deferred attributes, let the ORM load them
+            values = getter(item)
+        return dict(zip(names, values))
+
+    return serialize_item
+
+def read_rows(query, stream=False):
+    # read only fast path for projected queries: the SELECT runs on the session's connection
+    # and the rows stay plain tuples, no identity map, no instrumented objects and nothing
+    # for the unit of work to track
+    connection = query.session.connection()
+    if stream:
+        connection = connection.execution_options(stream_results=True, max_row_buffer=STREAM_BATCH_SIZE)
+    return connection.execute(query.statement)
+
+def serialize(item, fields=None):
+    if fields is None:
+        return item.serialize()
+    # projected rows come in the order of fields
+    return dict(zip(fields, item))
+
+def make_etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def etag_header(etag):
+    return {'ETag': quote_etag(etag)}
+
+def not_modified(etag):
+    # weak comparison, compressed responses carry the ETag as W/"..."
+    return request.if_none_match.contains_weak(etag)
+
+def collection_headers(etag):
+    # the same url answers JSON or NDJSON depending on the Accept header
+    return {'ETag': quote_etag(etag), 'Vary': 'Accept'}
+
+def representation(stream):
+    return 'ndjson' if stream else 'json'
+
+def versions_query(models):
+    # the table_version rows of the tables of a response, see models.TableVersion
+    table = models[0].metadata.tables['table_version']
+    return select(table.c.name, table.c.version).where(table.c.name.in_([model.__tablename__ for model in models]))
+
+def make_collection_etag(models, versions, stream, query_string):
+    # every committed write to one of the tables bumps its version, the representation
+    # separates a JSON page from the NDJSON stream of the same url and the query string
+    # separates pages and projections of the same table
+    versions = dict(versions)
+    return make_etag(models[0].__tablename__, *[versions.get(model.__tablename__) for model in models],
+                     representation(stream), query_string)
+
+def collection_etag(model, related=(), stream=False):
+    # related: the tables embedded with ?expand=, their rows are part of the response too
+    models = (model,) + tuple(related)
+    versions = model.query.session.execute(versions_query(models)).all()
+    return make_collection_etag(models, versions, stream, request.query_string.decode())
+
+def entity_etag(model, entity_id, version, fields):
+    return make_etag(model.__tablename__, entity_id, version, fields)
+
+def wants_stream(args=None, accept=None):
+    # ?stream=1 or an Accept header preferring NDJSON, defaults to the flask request
+    if (request.args if args is None else args).get('stream') in ('1', 'true'):
+        return True
+    accept = request.accept_mimetypes if accept is None else accept
+    return accept.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_ndjson(query, model, fields, sort=DEFAULT_SORT, transform=None):
+    # STREAM_BATCH_SIZE rows at a time through a server side cursor, so memory stays
+    # bounded and the first rows go out before the query is finished.
+    # transform gets each batch of dicts before it is written, see expand.py
+    rows = read_rows(keyset(query, model, sort), stream=True)
+
+    def generate():
+        for batch in rows.partitions(STREAM_BATCH_SIZE):
+            items = [dict(zip(fields, item)) for item in batch]
+            if transform is not None:
+                transform(items)
+            for item in items:
+                yield dumps(item) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+def unique_violation(error):
+    # IntegrityError from a unique index: postgres unique_violation, mysql ER_DUP_ENTRY or sqlite
+    orig = error.orig
+    if getattr(orig, 'pgcode', None) == '23505':
+        return True
+    if getattr(orig, 'errno', None) == 1062 or (orig.args and orig.args[0] == 1062):
+        return True
+    return 'UNIQUE constraint failed' in str(orig)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -0,0 +1,93 @@
+"""
+Request body validation compiled once per model from its column types: one pass over the
+JSON object checks and converts every value, bad input is rejected before any SQL runs.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+def check_integer(value):
+    # bool is an int subclass, true/false are not numbers here
+    if type(value) is not int:
+        raise ValueError('must be an integer')
+    return value
+
+def check_float(value):
+    if type(value) not in (int, float):
+        raise ValueError('must be a number')
+    return float(value)
+
+def check_boolean(value):
+    if type(value) is not bool:
+        raise ValueError('must be true or false')
+    return value
+
+def check_datetime(value):
+    if not isinstance(value, str):
+        raise ValueError('must be an ISO 8601 date')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('must be an ISO 8601 date')
+
+def string_check(length):
+    def check_string(value):
+        if not isinstance(value, str):
+            raise ValueError('must be a string')
+        if length is not None and len(value) > length:
+            raise ValueError('must be at most %d characters' % length)
+        return value
+    return check_string
+
+TYPE_CHECKS = {
+    int: check_integer,
+    float: check_float,
+    bool: check_boolean,
+    datetime: check_datetime,
+}
+
+def column_check(column):
+    python_type = column.type.python_type
+    if python_type is str:
+        return string_check(getattr(column.type, 'length', None))
+    return TYPE_CHECKS[python_type]
+
+@lru_cache(maxsize=None)
+def validator(model, fields):
+    # fields: tuple of the column names a client may send, everything else in the body is ignored
+    columns = model.__table__.columns
+    checks = dict((name, column_check(columns[name])) for name in fields)
+    nullable = frozenset(name for name in fields if columns[name].nullable)
+    required = [name for name in fields if not columns[name].nullable]
+
+    def validate(body, partial=False):
+        # returns (row, None) or (None, error), partial skips the required fields for updates
+        if not isinstance(body, dict):
+            return None, 'Each item must be an object'
+        row = {}
+        errors = []
+        for name, value in body.items():
+            check = checks.get(name)
+            if check is None:
+                continue
+            if value is None:
+                if name in nullable:
+                    row[name] = None
+                elif partial:
+                    errors.append('%s cannot be null' % name)
+                continue
+            try:
+                row[name] = check(value)
+            except ValueError as e:
+                errors.append('%s %s' % (name, e))
+        if errors:
+            return None, ', '.join(errors)
+        # a create needs one value set, an update may set a nullable column back to null
+        if not row or (not partial and all(value is None for value in row.values())):
+            return None, 'At least one field shouldnt be empty'
+        if not partial:
+            missing = [name for name in required if row.get(name) in (None, '')]
+            if missing:
+                return None, 'Missing fields: ' + ', '.join(missing)
+        return row, None
+
+    return validate
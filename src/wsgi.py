@@ -2,6 +2,11 @@
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
 from app import app as application
+from models import db
+from database import dispose_after_fork
+
+# gunicorn forks its workers from this process, each one must open its own connections
+dispose_after_fork(application, db)
 
 if __name__ == "__main__":
     application.run()
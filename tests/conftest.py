@@ -0,0 +1,56 @@
+import os
+import sys
+import asyncio
+import tempfile
+import pytest
+
+# the app and the ASGI engine read these at import time
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['CACHE_BACKEND'] = 'memory'
+os.environ['METRICS_DIR'] = os.path.join(tempfile.mkdtemp(), 'metrics')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from app import app as flask_app
+from models import db, RESOURCES
+from cache import entity_cache
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        # ids start over with the new tables, entries of the previous test must go
+        for model in RESOURCES.values():
+            entity_cache.delete(model.__tablename__)
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def asgi_call(app):
+    # a request on the ASGI app, returns (status, headers, body)
+    import asgi
+
+    def call(method, path, query_string=b'', headers=(), body=b''):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'headers': list(headers)}
+        asyncio.run(asgi.application(scope, receive, send))
+        content = b''.join(message.get('body', b'') for message in messages[1:])
+        return messages[0]['status'], dict(messages[0]['headers']), content
+
+    return call
+
+@pytest.fixture
+def asgi_get(asgi_call):
+    # GET on the ASGI app, returns (status, headers, body)
+    return lambda path, query_string=b'', headers=(): asgi_call('GET', path, query_string, headers)
@@ -0,0 +1,96 @@
+"""
+A local stand-in for redis in the tests: a threaded TCP server speaking RESP with the
+commands RedisBackend sends, with the expiry of SET ... PX. Lua is not interpreted, the
+scripts of cache.py are registered here with their Python translation.
+"""
+import time
+import fnmatch
+import threading
+import socketserver
+import cache
+
+def add_script(server, keys, args):
+    # cache.ADD_SCRIPT: nothing when the table is deleted, else SET key value PX ttl NX
+    if server.lookup(keys[1]) is not None:
+        return 0
+    return 1 if server.set(keys[0], args[0], int(args[1]), nx=True) else 0
+
+SCRIPTS = {cache.ADD_SCRIPT.encode(): add_script}
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        # port 0, the system picks a free one: url is redis://127.0.0.1:<port>/0
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), RespHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self.url = 'redis://127.0.0.1:%d/0' % self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def lookup(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, px=None, nx=False):
+        if nx and self.lookup(key) is not None:
+            return False
+        self.data[key] = (value, None if px is None else time.time() + px / 1000.0)
+        return True
+
+    def execute(self, command, args):
+        with self.lock:
+            if command in (b'AUTH', b'SELECT', b'PING'):
+                return 'OK'
+            if command == b'GET':
+                return self.lookup(args[0])
+            if command == b'SET':
+                options = [arg.upper() for arg in args[2:]]
+                px = int(options[options.index(b'PX') + 1]) if b'PX' in options else None
+                return 'OK' if self.set(args[0], args[1], px, nx=b'NX' in options) else None
+            if command == b'EXISTS':
+                return sum(1 for key in args if self.lookup(key) is not None)
+            if command == b'DEL':
+                return sum(1 for key in args if self.data.pop(key, None) is not None)
+            if command == b'PTTL':
+                value, expires = self.data.get(args[0], (None, None))
+                return -2 if value is None else -1 if expires is None else int((expires - time.time()) * 1000)
+            if command == b'SCAN':
+                # the whole keyspace in one page, cursor 0 ends the iteration
+                pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+                return [b'0', [key for key in list(self.data) if self.lookup(key) is not None
+                               and fnmatch.fnmatchcase(key.decode(), pattern)]]
+            if command == b'EVAL':
+                count = int(args[1])
+                return SCRIPTS[args[0]](self, args[2:2 + count], args[2 + count:])
+            return Exception('ERR unknown command %s' % command.decode())
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(encode(self.server.execute(args[0].upper(), args[1:])))
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, Exception):
+        return b'-%s\r\n' % str(value).encode()
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
@@ -0,0 +1,80 @@
+import os
+import time
+import pytest
+import cache
+from cache import FileBackend, RedisBackend
+from resp_server import RespServer
+
+@pytest.fixture
+def file_backend(tmp_path):
+    return FileBackend(str(tmp_path), max_size=3)
+
+@pytest.fixture
+def resp_server():
+    server = RespServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=['file', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'file':
+        return FileBackend(str(tmp_path))
+    return RedisBackend(request.getfixturevalue('resp_server').url)
+
+def test_entries_expire(backend):
+    backend.set('planet', 1, {'name': 'Tatooine'}, 60)
+    backend.set('planet', 2, {'name': 'Hoth'}, 0.05)
+    assert backend.get('planet', 1) == {'name': 'Tatooine'}
+    time.sleep(0.1)
+    assert backend.get('planet', 2) is None
+
+def test_add_never_overwrites(backend):
+    assert backend.add('planet', 1, {'version': 1}, 60)
+    assert not backend.add('planet', 1, {'version': 0}, 60)
+    assert backend.get('planet', 1) == {'version': 1}
+    # an expired entry can be filled again
+    backend.set('planet', 2, {'version': 1}, 0.05)
+    time.sleep(0.1)
+    assert backend.add('planet', 2, {'version': 2}, 60)
+
+def test_delete_leaves_a_tombstone(backend, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_TOMBSTONE_TTL', 0.2)
+    backend.set('planet', 1, {'version': 1}, 60)
+    backend.delete('planet', 1)
+    assert backend.get('planet', 1) is None
+    # a request that loaded the row before the write cannot store it back
+    assert not backend.add('planet', 1, {'version': 1}, 60)
+    time.sleep(0.3)
+    assert backend.add('planet', 1, {'version': 2}, 60)
+
+def test_delete_table(backend, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_TOMBSTONE_TTL', 0.2)
+    for id in range(5):
+        backend.set('planet', id, {'id': id}, 60)
+    backend.set('vehicle', 1, {'id': 1}, 60)
+    backend.delete('planet')
+    assert [backend.get('planet', id) for id in range(5)] == [None] * 5
+    assert backend.get('vehicle', 1) == {'id': 1}
+    assert not backend.add('planet', 7, {'id': 7}, 60)
+    time.sleep(0.3)
+    assert backend.add('planet', 7, {'id': 7}, 60)
+
+def test_redis_one_key_per_entry(resp_server):
+    backend = RedisBackend(resp_server.url)
+    backend.set('planet', 1, {'id': 1}, 60)
+    assert 0 < backend.command('PTTL', 'cache:planet:1') <= 60000
+    assert list(resp_server.data) == [b'cache:planet:1']
+
+def test_file_cleanup(file_backend, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_CLEANUP_INTERVAL', 0)
+    directory = file_backend.directory
+    file_backend.set('planet', 100, {'id': 100}, 0.01)
+    time.sleep(0.05)
+    os.makedirs(os.path.join(directory, 'planet.1.2.deleted'))
+    for id in range(5):
+        file_backend.set('planet', id, {'id': id}, 60 + id)
+    # the expired entry and the trash went, the 3 entries to expire last are kept
+    assert sorted(os.listdir(os.path.join(directory, 'planet'))) == ['2.json', '3.json', '4.json']
+    assert os.listdir(directory) == ['planet']
+    assert file_backend.stats()['entity_cache_evictions_total'] >= 2
@@ -0,0 +1,15 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db
+
+def test_failed_query_is_timed_and_logged(app, caplog, monkeypatch):
+    monkeypatch.setitem(app.config, 'SLOW_QUERY_MS', 0)
+    with app.test_request_context('/planets'):
+        connection = db.session.connection()
+        with pytest.raises(OperationalError):
+            connection.execute(text('SELECT * FROM no_such_table'))
+        # the start time of the failed statement is not left behind for the next one
+        assert connection.info['query_start_time'] == []
+    assert any(record.getMessage().startswith('Failed query') and 'no_such_table' in record.getMessage()
+               for record in caplog.records)
@@ -0,0 +1,15 @@
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
+from jsonprovider import dumps
+
+def test_same_bytes_as_the_flask_provider(app):
+    value = {'results': [{'name': 'Tatooine', 'id': 1, 'diameter': 10465.5, 'gravity': None}],
+             'msg': 'ok', 'next_cursor': None, 'birth_year': datetime(1977, 5, 25).isoformat()}
+    expected = DefaultJSONProvider(app).response(value).get_data()
+    assert dumps(value) == expected.rstrip(b'\n')
+    assert app.json.response(value).get_data() == dumps(value)
+
+def test_provider_keeps_the_dumps_options(app):
+    assert app.json.dumps({'b': 1, 'a': 2}) == '{"a":2,"b":1}'
+    assert app.json.dumps({'b': 1, 'a': 2}, sort_keys=False) == '{"b": 1, "a": 2}'
+    assert app.json.dumps({'a': [1]}, indent=2) == '{\n  "a": [\n    1\n  ]\n}'
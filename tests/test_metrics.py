@@ -0,0 +1,34 @@
+import os
+import json
+import subprocess
+import sys
+from metrics import MetricsStore, RETIRED_SNAPSHOT
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def test_exited_workers_are_retired(tmp_path):
+    store = MetricsStore(str(tmp_path))
+    store.request_started()
+    store.request_finished('get_planets', 'GET', 200, 0.01)
+    for index in range(3):
+        with open(os.path.join(str(tmp_path), '%d-old%d.json' % (dead_pid(), index)), 'w') as f:
+            json.dump({'pid': dead_pid(), 'requests': {'get_planets|GET|200': 2}, 'latency': {},
+                       'in_flight': 1, 'gauges': {'db_pool_size': 5}}, f)
+    requests, _, in_flight, gauges = store.collect()
+    assert requests == {'get_planets|GET|200': 7}
+    # gauges and in flight requests only come from the live worker
+    assert (in_flight, gauges) == (0, {})
+    assert sorted(os.listdir(str(tmp_path))) == ['.lock', store.filename, RETIRED_SNAPSHOT]
+    # the retired counters are still counted, once
+    assert store.collect()[0] == {'get_planets|GET|200': 7}
+
+def test_a_reused_pid_gets_its_own_file(tmp_path):
+    first, second = MetricsStore(str(tmp_path)), MetricsStore(str(tmp_path))
+    for store in (first, second):
+        store.request_started()
+        store.request_finished('get_planets', 'GET', 200, 0.01)
+    assert first.filename != second.filename
+    assert first.collect()[0] == {'get_planets|GET|200': 2}
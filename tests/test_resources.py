@@ -0,0 +1,159 @@
+import json
+
+PLANET = {
+    'name': 'Tatooine', 'climate': 'arid', 'terrain': 'desert', 'population': 200000, 'gravity': '1 standard',
+    'rotation_period': 23, 'orbital_period': 304, 'diameter': 10465, 'surface_water': 1,
+}
+
+def create_planet(client):
+    response = client.post('/planets', json=PLANET)
+    assert response.status_code == 201
+    return response.get_json()['planet_created']['id']
+
+def test_detail_fields_updated_at(client):
+    planet_id = create_planet(client)
+    # the first request fills the entity cache, the second one is served from it
+    for _ in range(2):
+        response = client.get('/planets/%d?fields=updated_at' % planet_id)
+        assert response.status_code == 200
+        result = response.get_json()['result']
+        assert set(result) == {'id', 'updated_at'}
+        assert result['id'] == planet_id
+    listed = client.get('/planets?fields=updated_at').get_json()['results'][0]
+    assert listed['updated_at'] == result['updated_at']
+
+def test_detail_fields_updated_at_asgi(client, asgi_get):
+    planet_id = create_planet(client)
+    for _ in range(2):
+        status, headers, body = asgi_get('/planets/%d' % planet_id, b'fields=updated_at,name')
+        assert status == 200
+        assert set(json.loads(body)['result']) == {'id', 'updated_at', 'name'}
+
+def test_stream_and_page_have_their_own_etag(client, asgi_get):
+    create_planet(client)
+    page = client.get('/planets')
+    stream = client.get('/planets', headers={'Accept': 'application/x-ndjson'})
+    assert stream.mimetype == 'application/x-ndjson'
+    assert page.headers['ETag'] != stream.headers['ETag']
+    assert 'Accept' in page.headers['Vary'] and 'Accept' in stream.headers['Vary']
+    # a streamed body left open runs its generator, and pops its request context, when collected
+    stream.close()
+    # the ETag of the JSON page must not validate the stream
+    response = client.get('/planets', headers={'Accept': 'application/x-ndjson', 'If-None-Match': page.headers['ETag']})
+    assert response.status_code == 200
+    response.close()
+    assert client.get('/planets', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+    # same tags on the ASGI app
+    status, headers, body = asgi_get('/planets', headers=[(b'accept', b'application/x-ndjson'), (b'if-none-match', page.headers['ETag'].encode())])
+    assert status == 200
+    assert headers[b'etag'].decode() == stream.headers['ETag']
+    assert asgi_get('/planets', headers=[(b'if-none-match', page.headers['ETag'].encode())])[0] == 304
+
+def test_collection_etag_follows_every_write(client):
+    planet_id = create_planet(client)
+    etags = [client.get('/planets').headers['ETag']]
+
+    def changed():
+        etags.append(client.get('/planets').headers['ETag'])
+        return etags[-1] != etags[-2]
+
+    # reading does not move the version
+    assert not changed()
+    assert client.put('/planets/%d' % planet_id, json={'population': 1}).status_code == 200
+    assert changed()
+    assert client.post('/planets/bulk', json=[dict(PLANET, name='Hoth')]).get_json()['created'] == 1
+    assert changed()
+    # a like moves the planet counters
+    assert client.post('/likes', json={'planet_id': planet_id}).status_code == 201
+    assert changed()
+    assert client.delete('/planets/%d' % planet_id).status_code == 200
+    assert changed()
+    # embedded tables count too
+    like_etag = client.get('/likes?expand=planet').headers['ETag']
+    assert client.put('/planets/%d' % (planet_id + 1), json={'climate': 'frozen'}).status_code == 200
+    assert client.get('/likes?expand=planet').headers['ETag'] != like_etag
+
+def test_cache_fill_after_a_write_is_refused(client):
+    from models import Planet
+    from cache import entity_cache
+    planet_id = create_planet(client)
+    # a reader missed and loaded the row, then a PUT committed before the reader filled the cache
+    stale = {'version': '2000-01-01T00:00:00', 'result': dict(PLANET, id=planet_id, like_count=0)}
+    assert client.put('/planets/%d' % planet_id, json={'population': 5}).status_code == 200
+    entity_cache.add(Planet, planet_id, stale)
+    for _ in range(2):
+        assert client.get('/planets/%d' % planet_id).get_json()['result']['population'] == 5
+
+def test_update_of_an_immutable_field(client):
+    response = client.post('/users', json={'user_name': 'luke', 'name': 'Luke', 'email': 'luke@x', 'phone': 1})
+    user_id = response.get_json()['user_created']['id']
+    response = client.put('/users/%d' % user_id, json={'user_name': 'vader'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'user_name cannot be changed'
+    # the unchanged value can be sent back with the rest of the object
+    response = client.put('/users/%d' % user_id, json={'user_name': 'luke', 'name': 'Luke S.'})
+    assert response.status_code == 200
+
+def test_single_item_body_must_be_an_object(client):
+    for body in (None, [PLANET], 'planet'):
+        response = client.post('/planets', json=body)
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Request body must be an object'
+
+def test_asgi_writes_answer_as_flask(client, asgi_call):
+    # every request runs on both apps against the same rows, the answers must not differ
+    import json
+    create = {'user_name': 'leia', 'name': 'Leia', 'email': 'leia@x', 'phone': 2}
+    assert client.post('/users', json=create).status_code == 201
+    requests = [
+        ('POST', '/users', create),
+        ('POST', '/users', ['not', 'an', 'object']),
+        ('POST', '/likes', {'user_id': 1, 'planet_id': 99}),
+        ('PUT', '/users/1', {'user_name': 'han'}),
+        ('PUT', '/users/1', {'user_name': 'leia', 'phone': 'x'}),
+        ('PUT', '/users/99', {'name': 'nobody'}),
+        ('DELETE', '/users/99', None),
+    ]
+    for method, path, body in requests:
+        response = client.open(path, method=method, json=body)
+        status, _, content = asgi_call(method, path, body=json.dumps(body).encode())
+        assert (status, json.loads(content)) == (response.status_code, response.get_json()), (method, path)
+
+def test_bulk_delete_ids_must_be_integers(client):
+    create_planet(client)
+    response = client.delete('/planets/bulk', json=[True, 1.0, 9999])
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] == 0
+    assert [error['error'] for error in response.get_json()['errors']] == ['id is required', 'id is required', 'Planet 9999 not found']
+    assert client.get('/planets/1').status_code == 200
+
+def test_bulk_update_of_an_immutable_field(client):
+    for name in ('luke', 'leia'):
+        client.post('/users', json={'user_name': name, 'name': name, 'email': name + '@x', 'phone': 1})
+    response = client.put('/users/bulk', json=[{'id': 1, 'user_name': 'vader'}, {'id': 2, 'user_name': 'leia', 'name': 'Leia O.'}])
+    assert response.get_json()['updated'] == 1
+    assert response.get_json()['errors'] == [{'index': 0, 'error': 'user_name cannot be changed'}]
+    assert client.get('/users/1').get_json()['result']['user_name'] == 'luke'
+    assert client.get('/users/2').get_json()['result']['name'] == 'Leia O.'
+
+def test_like_needs_one_reference(client):
+    body = {'user_id': None, 'planet_id': None}
+    response = client.post('/likes', json=body)
+    assert (response.status_code, response.get_json()) == (400, {'error': 'At least one field shouldnt be empty'})
+    response = client.post('/likes/bulk', json=[body, {}])
+    assert response.get_json()['created'] == 0
+    assert [error['error'] for error in response.get_json()['errors']] == ['At least one field shouldnt be empty'] * 2
+
+def test_asgi_answers_the_cors_preflight(asgi_call):
+    status, headers, body = asgi_call('OPTIONS', '/planets/1', headers=[
+        (b'origin', b'http://localhost:3000'), (b'access-control-request-method', b'PUT'),
+        (b'access-control-request-headers', b'content-type')])
+    assert (status, body) == (200, b'')
+    assert headers[b'access-control-allow-origin'] == b'*'
+    assert b'PUT' in headers[b'access-control-allow-methods']
+    assert headers[b'access-control-allow-headers'] == b'content-type'
+
+def test_non_ascii_digits_are_rejected(client, asgi_get):
+    for query in ('after=²', 'ids=²', 'ids=1,٣'):
+        assert client.get('/planets?' + query).status_code == 400, query
+        assert asgi_get('/planets', query.encode())[0] == 400, query